@@ -0,0 +1,310 @@
+"""Benchmarks for the configuration generation pipeline
+
+Generates synthetic network_config.json files and device inventories, then
+times each stage of NetworkConfigGenerator on its own:
+
+    network_config  parse + index build for a synthetic network config
+    find_location   site lookups for every device in an inventory
+    render          render_template for every shipped .j2 model
+    write           render_to_file, streaming rendered configs to disk
+    upload          SFTP uploads to a local stand-in server
+
+Results are written as JSON so runs from different commits can be diffed:
+
+    python benchmarks/bench_pipeline.py --output bench_results.json
+    python benchmarks/bench_pipeline.py --devices 1000 --subnets 10 1000 --quick
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import config_gen  # noqa: E402
+
+SHIPPED_TEMPLATES = os.path.join(REPO_ROOT, 'templates')
+
+
+def make_network_config(subnet_count: int) -> Dict:
+    """Synthetic network config: consecutive /24 management subnets under 10.0.0.0/8"""
+    network_data = {}
+    for number in range(subnet_count):
+        second, third = divmod(number, 256)
+        prefix = f"10.{second}.{third}"
+        network_data[f"site-{number:05d}"] = {
+            "network_address": f"{prefix}.0",
+            "subnet_mask": "255.255.255.0",
+            "gateway": f"{prefix}.254",
+            "hosts_range": [f"{prefix}.1", f"{prefix}.253"]
+        }
+    return network_data
+
+
+def make_inventory(device_count: int, subnet_count: int, models: List[str], seed: int = 1) -> List[Dict]:
+    """Synthetic inventory rows spread randomly over the synthetic subnets"""
+    rng = random.Random(seed)
+    rows = []
+    for number in range(device_count):
+        second, third = divmod(rng.randrange(subnet_count), 256)
+        rows.append({
+            'hostname': f"bench-sw{number:06d}",
+            'ip_address': f"10.{second}.{third}.{rng.randint(1, 253)}",
+            'location': f"Bench building {number % 50}",
+            'access_vlan_id': str(100 + number % 20),
+            'access_vlan_name': 'desktop',
+            'voice_vlan_id': str(200 + number % 20),
+            'voice_vlan_name': 'voice',
+            'model': models[number % len(models)],
+            'mac_address': f"{number:012x}",
+        })
+    return rows
+
+
+def write_inventory(path: str, rows: List[Dict]) -> None:
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(config_gen.INVENTORY_FIELDS)
+        for row in rows:
+            writer.writerow([row[field] for field in config_gen.INVENTORY_FIELDS])
+
+
+def shipped_models() -> List[str]:
+    return sorted(name[:-3] for name in os.listdir(SHIPPED_TEMPLATES) if name.endswith('.j2'))
+
+
+def result(stage: str, count: int, elapsed: float, **params) -> Dict:
+    return {
+        'stage': stage,
+        'params': params,
+        'count': count,
+        'total_s': round(elapsed, 6),
+        'per_op_us': round(elapsed / count * 1e6, 3) if count else None,
+        'ops_per_s': round(count / elapsed, 1) if elapsed else None,
+    }
+
+
+def point_generator_at(workdir: str, network_config_file: str) -> config_gen.NetworkConfigGenerator:
+    """Build a generator that reads the shipped templates and writes into workdir"""
+    config_gen.TEMPLATES_PATH = SHIPPED_TEMPLATES
+    config_gen.CONFIGS_PATH = os.path.join(workdir, 'generated_configs')
+    config_gen.TEMPLATE_CACHE_PATH = os.path.join(workdir, 'template_cache')
+    config_gen.TEMPLATE_CATALOG_FILE = os.path.join(config_gen.TEMPLATE_CACHE_PATH, 'catalog.json')
+    # Left empty so templates are compiled from the shipped sources
+    config_gen.COMPILED_TEMPLATES_PATH = os.path.join(workdir, 'compiled_templates')
+    config_gen.MANIFEST_FILE = os.path.join(workdir, 'manifest.json')
+    config_gen.ALLOCATIONS_FILE = os.path.join(workdir, 'ip_allocations.json')
+    config_gen.INVENTORY_DB = os.path.join(workdir, 'inventory.sqlite3')
+    config_gen.NETWORK_CONFIG_FILE = network_config_file
+    return config_gen.NetworkConfigGenerator()
+
+
+def bench_network_config(workdir: str, subnet_counts: List[int]) -> List[Dict]:
+    results = []
+    for subnet_count in subnet_counts:
+        path = os.path.join(workdir, f"network_config_{subnet_count}.json")
+        with open(path, 'w') as json_file:
+            json.dump(make_network_config(subnet_count), json_file)
+
+        generator = point_generator_at(workdir, path)
+        started = time.perf_counter()
+        generator.network_config.refresh()
+        results.append(result('network_config', 1, time.perf_counter() - started, subnets=subnet_count))
+    return results
+
+
+def bench_find_location(workdir: str, subnet_counts: List[int], device_counts: List[int]) -> List[Dict]:
+    results = []
+    for subnet_count in subnet_counts:
+        path = os.path.join(workdir, f"network_config_{subnet_count}.json")
+        generator = point_generator_at(workdir, path)
+        network_data = generator.network_config.load()
+
+        for device_count in device_counts:
+            rows = make_inventory(device_count, subnet_count, ['bench'])
+            write_inventory(os.path.join(workdir, f"inventory_{device_count}.csv"), rows)
+
+            started = time.perf_counter()
+            for row in rows:
+                generator.find_location(row['ip_address'], network_data)
+            results.append(result(
+                'find_location', device_count, time.perf_counter() - started,
+                subnets=subnet_count, devices=device_count
+            ))
+    return results
+
+
+def bench_render(workdir: str, iterations: int) -> List[Dict]:
+    path = os.path.join(workdir, "network_config_render.json")
+    with open(path, 'w') as json_file:
+        json.dump(make_network_config(16), json_file)
+    generator = point_generator_at(workdir, path)
+
+    results = []
+    for model in shipped_models():
+        rows = make_inventory(iterations, 16, [model])
+        site_context = generator.find_site_context(rows[0]['ip_address'])
+
+        # First render compiles the template; time it separately from the steady state
+        started = time.perf_counter()
+        render_args = {field: rows[0][field] for field in config_gen.INVENTORY_FIELDS if field != 'mac_address'}
+        generator.render_template(
+            gateway=site_context['gateway'], subnet=site_context['subnet'],
+            ip_acl=site_context['ip_acl'], **render_args
+        )
+        first = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for row in rows:
+            render_args = {field: row[field] for field in config_gen.INVENTORY_FIELDS if field != 'mac_address'}
+            generator.render_template(
+                gateway=site_context['gateway'], subnet=site_context['subnet'],
+                ip_acl=site_context['ip_acl'], **render_args
+            )
+        results.append(result(
+            'render', iterations, time.perf_counter() - started,
+            model=model, first_render_s=round(first, 6)
+        ))
+    return results
+
+
+def bench_write(workdir: str, file_count: int, model: str = 'C9300-48U') -> List[Dict]:
+    path = os.path.join(workdir, "network_config_write.json")
+    with open(path, 'w') as json_file:
+        json.dump(make_network_config(16), json_file)
+    generator = point_generator_at(workdir, path)
+
+    rows = make_inventory(file_count, 16, [model])
+    site_contexts = [generator.find_site_context(row['ip_address']) for row in rows]
+
+    target = os.path.join(workdir, 'write_bench')
+    os.makedirs(target, exist_ok=True)
+    # Compile the template before timing, as bench_render reports that separately
+    generator.render_config(rows[0], site_contexts[0])
+
+    started = time.perf_counter()
+    for row, site_context in zip(rows, site_contexts):
+        generator.render_to_file(row, site_context, os.path.join(target, f"{row['hostname']}-confg"))
+    elapsed = time.perf_counter() - started
+
+    size = os.path.getsize(os.path.join(target, f"{rows[0]['hostname']}-confg"))
+    generator.close()
+    return [result('write', file_count, elapsed, model=model, bytes_per_file=size)]
+
+
+def bench_upload(workdir: str, file_count: int, concurrency: int) -> List[Dict]:
+    try:
+        from benchmarks import standin_sftp
+    except ImportError as e:
+        logging.warning(f"Skipping upload benchmark: {e}")
+        return []
+
+    from transfer import SFTPSessionPool, UploadScheduler
+
+    server_root = os.path.join(workdir, 'sftp_root')
+    port = standin_sftp.start_server(server_root)
+    source = os.path.join(workdir, 'write_bench')
+    files = sorted(os.listdir(source))[:file_count]
+
+    results = []
+    pool = SFTPSessionPool('127.0.0.1', 'bench', 'benchmark', port=port, max_sessions=concurrency)
+    try:
+        started = time.perf_counter()
+        for name in files:
+            pool.put(os.path.join(source, name), f"ztp/{name}")
+        results.append(result('upload', len(files), time.perf_counter() - started, mode='sequential'))
+
+        scheduler = UploadScheduler(
+            lambda local, remote: pool.put(local, f"ztp/{remote}"), concurrency=concurrency
+        )
+        started = time.perf_counter()
+        for name in files:
+            scheduler.submit(os.path.join(source, name), name)
+        statuses = scheduler.wait()
+        scheduler.close()
+        results.append(result(
+            'upload', len(files), time.perf_counter() - started,
+            mode='scheduled', concurrency=concurrency,
+            failed=sum(1 for status in statuses if not status.success)
+        ))
+    finally:
+        pool.close()
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the configuration generation pipeline")
+    parser.add_argument('--devices', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--subnets', type=int, nargs='+', default=[10, 1000, 50000])
+    parser.add_argument('--render-iterations', type=int, default=500)
+    parser.add_argument('--write-files', type=int, default=10000)
+    parser.add_argument('--upload-files', type=int, default=200)
+    parser.add_argument('--upload-concurrency', type=int, default=4)
+    parser.add_argument('--skip-upload', action='store_true')
+    parser.add_argument('--quick', action='store_true', help="Small sizes for a smoke run")
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        # dict.fromkeys drops the duplicates clamping creates, keeping the order
+        args.devices = list(dict.fromkeys(min(n, 1000) for n in args.devices))
+        args.subnets = list(dict.fromkeys(min(n, 1000) for n in args.subnets))
+        args.render_iterations = min(args.render_iterations, 50)
+        args.write_files = min(args.write_files, 200)
+        args.upload_files = min(args.upload_files, 20)
+
+    logging.basicConfig(level=logging.WARNING)
+    # The generator logs every render at INFO; keep that out of the timings
+    logging.getLogger('config_gen').setLevel(logging.WARNING)
+    logging.getLogger('network_data').setLevel(logging.WARNING)
+    # The stand-in server logs every client disconnect as an error
+    logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='config-gen-bench-') as workdir:
+        results += bench_network_config(workdir, args.subnets)
+        results += bench_find_location(workdir, args.subnets, args.devices)
+        results += bench_render(workdir, args.render_iterations)
+        results += bench_write(workdir, args.write_files)
+        if not args.skip_upload:
+            results += bench_upload(workdir, min(args.upload_files, args.write_files), args.upload_concurrency)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': results,
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+
+    for entry in results:
+        params = ', '.join(f"{key}={value}" for key, value in entry['params'].items())
+        print(f"{entry['stage']:<15} {entry['count']:>8} ops  {entry['total_s']:>10.4f}s  "
+              f"{entry['per_op_us'] or 0:>10.2f}us/op  {params}")
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
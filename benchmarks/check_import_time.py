@@ -0,0 +1,131 @@
+"""Start-up time budget check for config_gen.py
+
+Runs each start-up path in a fresh interpreter under `python -X importtime`
+and fails when the whole path takes longer than the budget, or when it
+pulls in a dependency that should only be loaded by the feature that needs
+it (tkinter for the GUI, paramiko for uploads, jinja2 for rendering).
+
+    python benchmarks/check_import_time.py
+    python benchmarks/check_import_time.py --budget-ms 100 --repeat 11
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported just by loading config_gen
+DEFERRED_MODULES = ['tkinter', 'paramiko', 'cryptography', 'jinja2', 'ipaddress', 'multiprocessing', 'tarfile']
+
+# Code run for each start-up path, the deferred modules it may load and its budget in ms
+SCENARIOS = {
+    'import': ("import config_gen", (), 150),
+    # Start-up work of a headless batch run, up to the first device
+    'headless': (
+        "import config_gen\n"
+        "config_gen.build_parser().parse_args(['batch', 'inventory.csv'])\n"
+        "config_gen.NetworkConfigGenerator().close()",
+        (),
+        150
+    ),
+    # A whole validate run; subnets need ipaddress and a cold template catalog jinja2
+    'validate': (
+        "import config_gen\n"
+        "args = config_gen.build_parser().parse_args(['validate', 'inventory.csv'])\n"
+        "config_gen.validate_inventory(args.inventory)",
+        ('ipaddress', 'jinja2'),
+        250
+    ),
+}
+
+# Small inventory in data.csv column order, for sites in the shipped network_config.json
+FIXTURE_INVENTORY = (
+    "sw-check-01,172.17.0.11,Building 1,100,desktop,200,voice,ZTP-C9300-48P-UXM,0c75bd000001\n"
+    "sw-check-02,172.17.4.12,Building 2,101,desktop,201,voice,ZTP-C9200L-24P-4X,0c75bd000002\n"
+    "sw-check-03,172.17.8.13,Building 3,102,desktop,202,voice,ZTP-C9300L-48P-4X,0c75bd000003\n"
+)
+
+TIMED = (
+    "import time as _time\n"
+    "_started = _time.perf_counter()\n"
+    "{code}\n"
+    "_elapsed = _time.perf_counter() - _started\n"
+    "import sys, json\n"
+    "print(json.dumps([_elapsed * 1000, sorted(m for m in {modules!r} if m in sys.modules)]))"
+)
+
+
+def make_workdir(workdir: str) -> None:
+    """Copy the shipped templates and network config next to a fixture inventory"""
+    shutil.copytree(
+        os.path.join(REPO_ROOT, 'templates'), os.path.join(workdir, 'templates'),
+        ignore=shutil.ignore_patterns('__pycache__')
+    )
+    shutil.copy(os.path.join(REPO_ROOT, 'network_config.json'), workdir)
+    with open(os.path.join(workdir, 'inventory.csv'), 'w') as inventory_file:
+        inventory_file.write(FIXTURE_INVENTORY)
+
+
+def measure(code: str) -> Tuple[float, List[str], List[Tuple[str, int]]]:
+    """Run code under -X importtime; return (elapsed ms, loaded deferred modules, slowest imports)
+
+    Each run gets a fresh working directory with the fixture files, so no
+    caches carry over between runs and nothing lands in the repository;
+    config_gen is found through PYTHONPATH.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    with tempfile.TemporaryDirectory(prefix='import-time-') as workdir:
+        make_workdir(workdir)
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', TIMED.format(code=code, modules=DEFERRED_MODULES)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        )
+
+    cumulative: Dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        # "import time: <self us> | <cumulative us> | <indented module name>"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        cumulative[name] = max(cumulative.get(name, 0), int(cumulative_us))
+
+    slowest = sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:10]
+    elapsed_ms, loaded = json.loads(completed.stdout.strip().splitlines()[-1])
+    return elapsed_ms, loaded, slowest
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check config_gen start-up time against a budget")
+    # The budgets sit well above the usual medians, which swing by about 40ms on a busy machine
+    parser.add_argument('--budget-ms', type=float, help="Maximum median start-up time for every scenario")
+    parser.add_argument('--repeat', type=int, default=7, help="Fresh interpreters per scenario")
+    parser.add_argument('--verbose', action='store_true', help="List the slowest imports")
+    args = parser.parse_args(argv)
+
+    ok = True
+    for scenario, (code, allowed, budget_ms) in SCENARIOS.items():
+        budget_ms = args.budget_ms or budget_ms
+        runs = [measure(code) for _ in range(max(1, args.repeat))]
+        median_ms = statistics.median(run[0] for run in runs)
+        loaded = [name for name in runs[-1][1] if name not in allowed]
+
+        status = "ok" if median_ms <= budget_ms and not loaded else "FAIL"
+        ok = ok and status == "ok"
+        print(f"{scenario:<10} {median_ms:8.1f}ms (budget {budget_ms:.0f}ms)  {status}")
+        if loaded:
+            print(f"  loaded at startup: {', '.join(loaded)}")
+        if args.verbose or status != "ok":
+            for name, cumulative_us in runs[-1][2]:
+                print(f"  {cumulative_us / 1000:8.1f}ms  {name}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Output equivalence check for the render shortcuts in config_gen.py
+
+Renders every shipped model for a synthetic inventory and fails when
+
+    site_cache  SiteTemplateCache output differs from a plain template render
+    engine      the process-pool render engine writes files that differ from
+                the ones a serial generate_configuration run writes
+
+so a template that uses device fields in logic, or a change to either
+shortcut, cannot silently alter the generated configurations.
+
+    python benchmarks/check_render_equivalence.py
+    python benchmarks/check_render_equivalence.py --devices 2000 --workers 4
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from typing import List
+
+# bench_pipeline puts the repository on sys.path, so it is imported first
+from bench_pipeline import SHIPPED_TEMPLATES, make_inventory, make_network_config, shipped_models, write_inventory
+
+import config_gen  # noqa: E402
+
+
+def point_at(workdir: str) -> None:
+    """Keep every file the generator reads or writes inside workdir
+
+    The templates and network config are copied under their default names
+    and workdir becomes the working directory, so engine workers started
+    with spawn instead of fork resolve the same paths.
+    """
+    shutil.copytree(SHIPPED_TEMPLATES, os.path.join(workdir, 'templates'), ignore=shutil.ignore_patterns('__pycache__'))
+    network_config_file = os.path.join(workdir, 'network_config.json')
+    with open(network_config_file, 'w') as json_file:
+        json.dump(make_network_config(16), json_file)
+    os.chdir(workdir)
+
+    config_gen.TEMPLATES_PATH = os.path.join(workdir, 'templates')
+    config_gen.NETWORK_CONFIG_FILE = network_config_file
+    config_gen.TEMPLATE_CACHE_PATH = os.path.join(workdir, 'template_cache')
+    config_gen.TEMPLATE_CATALOG_FILE = os.path.join(config_gen.TEMPLATE_CACHE_PATH, 'catalog.json')
+    config_gen.COMPILED_TEMPLATES_PATH = os.path.join(workdir, 'compiled_templates')
+    config_gen.MANIFEST_FILE = os.path.join(workdir, 'manifest.json')
+    config_gen.ALLOCATIONS_FILE = os.path.join(workdir, 'ip_allocations.json')
+    config_gen.INVENTORY_DB = os.path.join(workdir, 'inventory.sqlite3')
+
+
+def check_site_cache(rows: List[dict]) -> List[str]:
+    """Hostnames whose cached render or streamed chunks differ from a plain render"""
+    generator = config_gen.NetworkConfigGenerator()
+    environment = generator.get_environment()
+    mismatches = []
+    try:
+        for data in rows:
+            site_context = generator.find_site_context(data['ip_address'])
+            template = environment.get_template(f"{data['model']}.j2")
+            plain = template.render(**generator.template_values(data, site_context))
+            cached = generator.render_config(data, site_context)
+            streamed = ''.join(generator.render_config_chunks(data, site_context))
+            if not plain == cached == streamed:
+                mismatches.append(data['hostname'])
+    finally:
+        generator.close()
+    return mismatches
+
+
+def read_outputs(directory: str) -> dict:
+    outputs = {}
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name), 'rb') as config_file:
+            outputs[name] = config_file.read()
+    return outputs
+
+
+def check_engine(workdir: str, rows: List[dict], workers: int) -> List[str]:
+    """Config files that differ between a serial run and the process-pool engine"""
+    inventory_file = os.path.join(workdir, 'inventory.csv')
+    write_inventory(inventory_file, rows)
+
+    serial_path = os.path.join(workdir, 'serial')
+    os.makedirs(serial_path)
+    config_gen.CONFIGS_PATH = serial_path
+    generator = config_gen.NetworkConfigGenerator()
+    try:
+        for data in config_gen.read_inventory(inventory_file):
+            generator.generate_configuration(dict(data), force=True)
+    finally:
+        generator.close()
+
+    engine_path = os.path.join(workdir, 'engine')
+    os.makedirs(engine_path)
+    config_gen.CONFIGS_PATH = engine_path
+    config_gen.render_fleet(inventory_file, workers=workers, chunk_size=16, force=True, validate=False)
+
+    serial, engine = read_outputs(serial_path), read_outputs(engine_path)
+    # A device neither run wrote counts as a difference too
+    expected = {f"{data['hostname']}-confg" for data in rows}
+    return sorted(
+        name for name in expected | set(serial) | set(engine)
+        if name not in serial or serial.get(name) != engine.get(name)
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check render shortcuts against plain and serial renders")
+    parser.add_argument('--devices', type=int, default=200, help="Synthetic devices, spread over every model")
+    parser.add_argument('--workers', type=int, default=2, help="Render engine processes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    # The generator logs every render and write at INFO
+    logging.getLogger('config_gen').setLevel(logging.WARNING)
+
+    rows = make_inventory(args.devices, 16, shipped_models())
+    original_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='render-equivalence-') as workdir:
+        try:
+            point_at(workdir)
+            checks = [
+                ('site_cache', check_site_cache(rows)),
+                ('engine', check_engine(workdir, rows, args.workers)),
+            ]
+        finally:
+            os.chdir(original_directory)
+
+    ok = True
+    for check, mismatches in checks:
+        print(f"{check:<11} {len(rows)} devices  {'FAIL' if mismatches else 'ok'}")
+        for name in mismatches[:20]:
+            print(f"  differs: {name}")
+        ok = ok and not mismatches
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
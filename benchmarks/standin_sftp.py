@@ -0,0 +1,119 @@
+"""Minimal local SFTP server used as an upload target by the benchmarks
+
+Accepts any username with the password given to start_server() and stores
+uploads under a local directory. It implements just enough of the SFTP
+protocol for paramiko's put() and is not meant for anything but benchmarks.
+"""
+import os
+import socket
+import threading
+
+import paramiko
+from paramiko import (
+    AUTH_FAILED,
+    AUTH_SUCCESSFUL,
+    OPEN_SUCCEEDED,
+    SFTP_OK,
+    ServerInterface,
+    SFTPAttributes,
+    SFTPHandle,
+    SFTPServer,
+    SFTPServerInterface,
+)
+
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+def _sftp_interface(root: str):
+    class LocalSFTPInterface(SFTPServerInterface):
+        def _local(self, path):
+            return os.path.join(root, path.lstrip('/'))
+
+        def canonicalize(self, path):
+            return '/' + path.lstrip('/')
+
+        def stat(self, path):
+            try:
+                return SFTPAttributes.from_stat(os.stat(self._local(path)))
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+
+        lstat = stat
+
+        def open(self, path, flags, attr):
+            try:
+                fd = os.open(self._local(path), flags, 0o644)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            mode = 'wb' if flags & os.O_WRONLY else ('r+b' if flags & os.O_RDWR else 'rb')
+            handle = _Handle(flags)
+            handle.filename = self._local(path)
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        def list_folder(self, path):
+            entries = []
+            for name in os.listdir(self._local(path)):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(self._local(path), name)))
+                attr.filename = name
+                entries.append(attr)
+            return entries
+
+        def mkdir(self, path, attr):
+            os.makedirs(self._local(path), exist_ok=True)
+            return SFTP_OK
+
+        def remove(self, path):
+            os.remove(self._local(path))
+            return SFTP_OK
+
+        def rename(self, old_path, new_path):
+            os.replace(self._local(old_path), self._local(new_path))
+            return SFTP_OK
+
+        posix_rename = rename
+
+    return LocalSFTPInterface
+
+
+class _PasswordServer(ServerInterface):
+    def __init__(self, password: str):
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        return AUTH_SUCCESSFUL if password == self.password else AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return OPEN_SUCCEEDED
+
+
+def start_server(root: str, password: str = 'benchmark') -> int:
+    """Serve root over SFTP on a free localhost port and return the port"""
+    os.makedirs(os.path.join(root, 'ztp'), exist_ok=True)
+    host_key = paramiko.RSAKey.generate(2048)
+    interface = _sftp_interface(root)
+
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(64)
+
+    def accept_loop():
+        while True:
+            client, _ = listener.accept()
+            transport = paramiko.Transport(client)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler('sftp', SFTPServer, interface)
+            transport.start_server(server=_PasswordServer(password))
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()[1]
@@ -1,16 +1,47 @@
 ##ccb6c89ac300
-import tkinter as tk
-from tkinter import ttk, messagebox
 import csv
-from jinja2 import Environment, FileSystemLoader
-import ipaddress
+import argparse
+import getpass
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
+import threading
+import queue
+import itertools
 import os
+import time
 import sys
-import re
-import paramiko
-from typing import Dict, Optional, Any, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Any, Tuple, Iterable, Iterator, Callable
 import logging
+from network_data import NetworkConfigLoader, get_subnet_index
+from transfer import (
+    ReplicatedUploader, SFTPSessionPool, TargetResult, UploadScheduler, required_successes,
+    upload_archive, upload_pipelined
+)
+from instrumentation import StageMetrics, timed_stage
+from partial_render import SiteTemplateCache, split_values
+from validation import InventoryValidator, ValidationIssue, is_valid_mac
+from ip_allocation import AUTO_ADDRESS, IPAllocator
+from inventory_store import DEVICE_FIELDS, DeviceInventory
+from template_catalog import TemplateCatalog
+
+if TYPE_CHECKING:
+    import jinja2
+
+# tkinter is only needed by the GUI; load_tkinter() fills these in on first use.
+# jinja2, paramiko, ipaddress and multiprocessing are likewise imported where
+# they are used so headless runs start quickly.
+tk = ttk = messagebox = None
+
+
+def load_tkinter() -> None:
+    """Import tkinter for the GUI classes below"""
+    global tk, ttk, messagebox
+    if tk is None:
+        import tkinter
+        from tkinter import ttk as tkinter_ttk, messagebox as tkinter_messagebox
+        tk, ttk, messagebox = tkinter, tkinter_ttk, tkinter_messagebox
 
 # Constants
 # Constants
@@ -27,44 +58,443 @@ def resource_path(relative_path):
     
     return os.path.join(base_path, relative_path)
 
+def data_path(relative_path):
+    """Get absolute path to state kept between runs, next to the executable when frozen
+    
+    A onefile PyInstaller build unpacks into a new temporary directory on
+    every start, so nothing written under resource_path() would survive.
+    """
+    if getattr(sys, 'frozen', False):
+        base_path = os.path.dirname(os.path.abspath(sys.executable))
+    else:
+        base_path = os.path.abspath(".")
+    
+    return os.path.join(base_path, relative_path)
+
 # Get paths that work in both development and compiled versions
 TEMPLATES_PATH = resource_path('templates')
 CONFIGS_PATH = resource_path('generated_configs')
 NETWORK_CONFIG_FILE = resource_path('network_config.json')
+TEMPLATE_CACHE_PATH = data_path('template_cache')
+# Content hash, variables and output type of every template, kept between runs
+TEMPLATE_CATALOG_FILE = os.path.join(TEMPLATE_CACHE_PATH, 'catalog.json')
+MANIFEST_FILE = data_path('generated_configs.manifest.json')
+# Used-address bitmaps and per-hostname assignments for ip_address 'auto'
+ALLOCATIONS_FILE = data_path('ip_allocations.json')
+# Every device submitted or generated, indexed by hostname, IP, MAC and site
+INVENTORY_DB = data_path('inventory.sqlite3')
+# Output of the compile-templates build step, bundled with the PyInstaller build
+COMPILED_TEMPLATES_PATH = resource_path('compiled_templates')
+COMPILED_TEMPLATES_INDEX = 'sources.json'
 
 
 
 FTP_SERVER_IP = '10.36.50.60'  # Hardcoded FTP IP
+# Every file is uploaded to each of these servers in parallel, so a switch
+# can fetch its configuration from the server at whichever site it boots in.
+# Set ZTP_UPLOAD_TARGETS to a comma-separated list, e.g.
+# "10.36.50.60,10.28.50.60", to upload to more than FTP_SERVER_IP.
+UPLOAD_TARGETS = [
+    host.strip()
+    for host in os.environ.get('ZTP_UPLOAD_TARGETS', FTP_SERVER_IP).split(',')
+    if host.strip()
+]
+# 'all': every target must take a file; 'quorum': a majority of them must
+WRITE_POLICY = os.environ.get('ZTP_WRITE_POLICY', 'all')
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Column order of data.csv and batch inventory files; mac_address is optional
+INVENTORY_FIELDS = [
+    'hostname',
+    'ip_address',
+    'location',
+    'access_vlan_id',
+    'access_vlan_name',
+    'voice_vlan_id',
+    'voice_vlan_name',
+    'model',
+    'mac_address'
+]
+
+# Variables every template is rendered with; see NetworkConfigGenerator.template_values
+TEMPLATE_VARIABLES = (
+    'model',
+    'hostname',
+    'ip_address',
+    'access_vlan_id',
+    'access_vlan_name',
+    'voice_vlan_id',
+    'voice_vlan_name',
+    'location',
+    'gateway',
+    'subnet',
+    'ip_acl',
+)
+
+
+class DeviceRecord:
+    """One inventory row, stored in slots rather than a per-row dict
+    
+    Supports the mapping operations the pipeline uses on rows (record[field],
+    get(), keys() and dict(record)), so it can stand in for a row dict while
+    keeping 100k-row runs compact. Besides INVENTORY_FIELDS it carries the
+    optional 'site' column and the per-run 'upload' flag.
+    """
+    
+    FIELDS = tuple(INVENTORY_FIELDS) + ('site', 'upload')
+    __slots__ = FIELDS
+    
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            setattr(self, field, values.get(field, False if field == 'upload' else ''))
+            
+    def __getitem__(self, field: str):
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+        
+    def __setitem__(self, field: str, value) -> None:
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        setattr(self, field, value)
+        
+    def __contains__(self, field: str) -> bool:
+        return field in self.FIELDS
+        
+    def get(self, field: str, default=None):
+        return getattr(self, field) if field in self.FIELDS else default
+        
+    def keys(self) -> Tuple[str, ...]:
+        return self.FIELDS
+        
+    def __eq__(self, other) -> bool:
+        return isinstance(other, DeviceRecord) and all(self[field] == other[field] for field in self.FIELDS)
+        
+    def __repr__(self) -> str:
+        return f"DeviceRecord({', '.join(f'{field}={self[field]!r}' for field in self.FIELDS)})"
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 hex digest of a file's contents"""
+    with open(path, 'rb') as source_file:
+        return hashlib.sha256(source_file.read()).hexdigest()
+
+
+class CheckedModuleLoader:
+    """Loader that only serves modules compiled from the current template source
+    
+    Wraps a jinja2 ModuleLoader. The compile step records the hash of every
+    source template; a compiled module whose source has since been edited is
+    treated as missing, so a ChoiceLoader falls through to the source template.
+    """
+    
+    def __init__(self, path: str, source_path: str):
+        from jinja2 import ModuleLoader
+        
+        self.modules = ModuleLoader(path)
+        self.source_path = source_path
+        with open(os.path.join(path, COMPILED_TEMPLATES_INDEX), 'r') as index_file:
+            self.source_hashes: Dict[str, str] = json.load(index_file)
+            
+    def get_source(self, environment, template):
+        from jinja2 import TemplateNotFound
+        
+        raise TemplateNotFound(template)
+        
+    def list_templates(self) -> List[str]:
+        return sorted(self.source_hashes)
+        
+    def load(self, environment, name, globals=None):
+        from jinja2 import TemplateNotFound
+        
+        expected_hash = self.source_hashes.get(name)
+        if expected_hash is None:
+            raise TemplateNotFound(name)
+            
+        source_file = os.path.join(self.source_path, name)
+        if not os.path.exists(source_file):
+            # Bundles may ship only the compiled modules
+            return self.modules.load(environment, name, globals)
+            
+        source_stat = os.stat(source_file)
+        if file_sha256(source_file) != expected_hash:
+            raise TemplateNotFound(name)
+            
+        template = self.modules.load(environment, name, globals)
+        # Let the environment drop the compiled template if the source changes later
+        stat_key = (source_stat.st_mtime_ns, source_stat.st_size)
+        template._uptodate = lambda: os.path.exists(source_file) and (
+            os.stat(source_file).st_mtime_ns, os.stat(source_file).st_size
+        ) == stat_key
+        return template
+
+
+def compile_templates(target: str = COMPILED_TEMPLATES_PATH) -> int:
+    """Precompile every template under TEMPLATES_PATH into Python modules in target
+    
+    Returns the number of templates compiled. Run this before packaging so
+    the frozen build loads template modules instead of lexing and compiling
+    the .j2 sources at startup.
+    
+    Only the modules and index from an earlier compile are removed from
+    target. Raises ValueError for a target that overlaps TEMPLATES_PATH or
+    is a non-empty directory this step did not create.
+    """
+    from jinja2 import Environment, FileSystemLoader
+    
+    target_path = os.path.realpath(target)
+    templates_path = os.path.realpath(TEMPLATES_PATH)
+    if os.path.commonpath([target_path, templates_path]) in (target_path, templates_path):
+        raise ValueError(f"Refusing to compile into {target}: it overlaps the templates directory {TEMPLATES_PATH}")
+    if os.path.isdir(target) and os.listdir(target) and not os.path.exists(os.path.join(target, COMPILED_TEMPLATES_INDEX)):
+        raise ValueError(f"Refusing to compile into {target}: it is not empty and holds no {COMPILED_TEMPLATES_INDEX}")
+    
+    environment = Environment(loader=FileSystemLoader(TEMPLATES_PATH))
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(target):
+        if name == COMPILED_TEMPLATES_INDEX or (name.startswith('tmpl_') and name.endswith('.py')):
+            os.remove(os.path.join(target, name))
+    
+    names = environment.list_templates(extensions=['j2'])
+    environment.compile_templates(
+        target,
+        extensions=['j2'],
+        zip=None,
+        ignore_errors=False,
+        log_function=logging.getLogger(__name__).info
+    )
+    
+    source_hashes = {name: file_sha256(os.path.join(TEMPLATES_PATH, name)) for name in names}
+    with open(os.path.join(target, COMPILED_TEMPLATES_INDEX), 'w') as index_file:
+        json.dump(source_hashes, index_file, indent=1, sort_keys=True)
+    return len(names)
+
+
+class GenerationManifest:
+    """Record of what was last rendered and uploaded for each device
+    
+    Each entry holds a hash of the device's inputs (inventory row, site
+    context and template content) and of the rendered output, plus the
+    output hash each server last received under each remote file name.
+    Devices whose inputs are unchanged are not re-rendered, and outputs that
+    every server already has are not uploaded again.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, path: str, autosave: bool = True):
+        self.path = path
+        self.autosave = autosave
+        self.devices: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.load()
+        
+    def load(self) -> None:
+        """Read the manifest from disk, starting empty if it is missing or unreadable"""
+        try:
+            with open(self.path, 'r') as manifest_file:
+                content = json.load(manifest_file)
+            if content.get('version') == self.VERSION:
+                self.devices = content.get('devices', {})
+        except FileNotFoundError:
+            self.devices = {}
+        except (ValueError, OSError) as e:
+            logging.getLogger(__name__).warning(f"Ignoring unreadable manifest {self.path}: {e}")
+            self.devices = {}
+            
+    def save(self) -> None:
+        """Atomically write the manifest back to disk
+        
+        Saves run one at a time, each through its own temporary file, so an
+        older snapshot never replaces a newer one and no two writers share a
+        partly written file.
+        """
+        import tempfile
+        
+        with self._save_lock:
+            with self._lock:
+                content = json.dumps({'version': self.VERSION, 'devices': self.devices}, indent=1, sort_keys=True)
+            manifest_file = tempfile.NamedTemporaryFile(
+                'w', dir=os.path.dirname(os.path.abspath(self.path)),
+                prefix=f"{os.path.basename(self.path)}.", suffix='.tmp', delete=False
+            )
+            try:
+                with manifest_file:
+                    manifest_file.write(content)
+                os.replace(manifest_file.name, self.path)
+            except OSError:
+                os.remove(manifest_file.name)
+                raise
+        
+    @staticmethod
+    def input_hash(data: Dict, site_context: Dict, template_hash: str) -> str:
+        """Hash everything that feeds into a device's rendered configuration"""
+        inputs = {
+            'row': {field: data.get(field, '') for field in INVENTORY_FIELDS},
+            'site': site_context,
+            'template': template_hash,
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+        
+    @staticmethod
+    def output_hash(rendered_config: str) -> str:
+        return hashlib.sha256(rendered_config.encode()).hexdigest()
+        
+    def get(self, hostname: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self.devices.get(hostname)
+            if not entry:
+                return None
+            uploads = {
+                remote_file: dict(hosts) if isinstance(hosts, dict) else hosts
+                for remote_file, hosts in entry.get('uploads', {}).items()
+            }
+            return dict(entry, uploads=uploads)
+            
+    def put(self, hostname: str, entry: Optional[Dict]) -> None:
+        """Replace a device's entry, e.g. with one recorded by a worker process"""
+        if entry is None:
+            return
+        with self._lock:
+            self.devices[hostname] = entry
+        if self.autosave:
+            self.save()
+        
+    def is_current(self, hostname: str, input_hash: str) -> bool:
+        """True when the device was last rendered from identical inputs"""
+        with self._lock:
+            entry = self.devices.get(hostname)
+            return bool(entry) and entry.get('input_hash') == input_hash
+        
+    def record_render(self, hostname: str, model: str, input_hash: str, output_hash: str) -> None:
+        with self._lock:
+            entry = self.devices.setdefault(hostname, {})
+            entry.update(model=model, input_hash=input_hash, output_hash=output_hash)
+            entry.setdefault('uploads', {})
+        if self.autosave:
+            self.save()
+            
+    @staticmethod
+    def _uploaded_to(entry: Dict, remote_file: str) -> Dict[str, str]:
+        """host -> output hash it last received as remote_file"""
+        hosts = entry.get('uploads', {}).get(remote_file)
+        # Entries from before uploads were tracked per server hold a bare hash
+        return hosts if isinstance(hosts, dict) else {}
+        
+    def missing_hosts(self, hostname: str, remote_file: str, hosts: Iterable[str]) -> List[str]:
+        """Those of hosts that do not have the current output of a device as remote_file"""
+        with self._lock:
+            entry = self.devices.get(hostname)
+            if not entry:
+                return list(hosts)
+            uploaded = self._uploaded_to(entry, remote_file)
+            return [host for host in hosts if uploaded.get(host) != entry.get('output_hash')]
+            
+    def is_uploaded(self, hostname: str, remote_file: str, hosts: Iterable[str]) -> bool:
+        """True when every one of hosts already has the current output of a device as remote_file"""
+        return not self.missing_hosts(hostname, remote_file, hosts)
+            
+    def record_upload(self, hostname: str, remote_file: str, host: str, output_hash: str) -> None:
+        with self._lock:
+            entry = self.devices.setdefault(hostname, {})
+            uploaded = dict(self._uploaded_to(entry, remote_file), **{host: output_hash})
+            entry.setdefault('uploads', {})[remote_file] = uploaded
+        if self.autosave:
+            self.save()
+
 
 class NetworkConfigGenerator:
-    def __init__(self):
+    def __init__(self, timing_log: Optional[str] = None):
         self.setup_logging()
+        self.metrics = StageMetrics(timing_log)
         self.ensure_directories_exist()
         self.ftp_username = None
         self.ftp_password = None
         self.authenticated = False
+        self.uploader: Optional[ReplicatedUploader] = None
+        self.upload_scheduler: Optional[UploadScheduler] = None
+        self.network_config = NetworkConfigLoader(NETWORK_CONFIG_FILE)
+        self._environment = None
+        self.site_templates = SiteTemplateCache(metrics=self.metrics)
+        self.template_catalog = get_template_catalog()
+        self.manifest = GenerationManifest(MANIFEST_FILE)
+        self._ip_allocator: Optional[IPAllocator] = None
+        self._inventory: Optional[DeviceInventory] = None
+        
+    def close(self) -> None:
+        """Release pooled network sessions"""
+        if self.upload_scheduler:
+            self.upload_scheduler.close()
+            self.upload_scheduler = None
+        if self.uploader:
+            self.uploader.close()
+            self.uploader = None
+        if self._inventory:
+            self._inventory.close()
+            self._inventory = None
+        self.metrics.close()
         
     def setup_logging(self):
         """Initialize logging configuration"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
         self.logger = logging.getLogger(__name__)
         
     def ensure_directories_exist(self):
         """Ensure required directories exist"""
         os.makedirs(TEMPLATES_PATH, exist_ok=True)
         os.makedirs(CONFIGS_PATH, exist_ok=True)
+        os.makedirs(TEMPLATE_CACHE_PATH, exist_ok=True)
+        
+    def get_environment(self) -> "jinja2.Environment":
+        """Return the shared Jinja2 environment, creating it on first use
+        
+        Compiled templates stay in the environment's cache for the life of the
+        generator, and the bytecode cache lets a fresh process skip compiling
+        templates that have not changed since the last run.
+        """
+        if self._environment is None:
+            from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, ChoiceLoader
+            
+            loader = FileSystemLoader(TEMPLATES_PATH)
+            if os.path.exists(os.path.join(COMPILED_TEMPLATES_PATH, COMPILED_TEMPLATES_INDEX)):
+                # Prefer precompiled modules, falling back to the .j2 sources
+                loader = ChoiceLoader([
+                    CheckedModuleLoader(COMPILED_TEMPLATES_PATH, TEMPLATES_PATH),
+                    loader
+                ])
+            self._environment = Environment(
+                loader=loader,
+                bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_PATH)
+            )
+        return self._environment
         
     def authenticate(self, username: str, password: str) -> bool:
-        """Authenticate with FTP server"""
+        """Authenticate with every upload target
+        
+        Logs in to all UPLOAD_TARGETS in parallel. Succeeds when enough of
+        them accept the login to satisfy WRITE_POLICY; targets that refused
+        are retried in the background while uploading, and by the next call.
+        """
         try:
-            # Test SFTP connection
-            transport = paramiko.Transport((FTP_SERVER_IP, 22))
-            transport.connect(username=username, password=password)
-            transport.close()
-            
+            uploader = ReplicatedUploader(
+                [SFTPSessionPool(host, username, password, metrics=self.metrics) for host in UPLOAD_TARGETS],
+                required_successes(WRITE_POLICY, len(UPLOAD_TARGETS)),
+                metrics=self.metrics
+            )
+            try:
+                # Log in once; the verified sessions stay in the pools for uploads
+                uploader.connect()
+            except Exception:
+                uploader.close()
+                raise
+                
+            self.close()
+            self.uploader = uploader
+            self.upload_scheduler = UploadScheduler(
+                self._sftp_put, concurrency=max(pool.max_sessions for pool in self.uploader.pools)
+            )
             self.ftp_username = username
             self.ftp_password = password
             self.authenticated = True
@@ -78,64 +508,159 @@ class NetworkConfigGenerator:
 
     def is_valid_mac_address(self, mac_address: str) -> bool:
         """Validate MAC address format"""
-        if not mac_address:
-            return False
-            
-        mac_pattern = re.compile(r'^([0-9A-Fa-f]{2}){6}$')
-        is_valid = bool(mac_pattern.match(mac_address))
-        
-        if is_valid:
-            self.logger.info(f"Valid MAC address: {mac_address}")
-        else:
+        is_valid = is_valid_mac(mac_address)
+        if not is_valid:
             self.logger.warning(f"Invalid MAC address: {mac_address}")
             
         return is_valid
 
+    @timed_stage('find_location')
     def find_location(self, ip_address: str, network_data: Dict) -> Optional[Dict]:
         """Find network location data for a given IP address"""
+        import ipaddress
+        
         try:
-            ip = ipaddress.IPv4Address(ip_address)
+            match = get_subnet_index(network_data).lookup(ip_address)
+            if match:
+                return match[1]
+                    
+        except ipaddress.AddressValueError as e:
+            self.logger.error(f"Invalid IP address {ip_address}: {e}")
             
-            for location, data in network_data.items():
-                network = ipaddress.IPv4Network(
-                    f"{data['network_address']}/{data['subnet_mask']}", 
-                    strict=False
-                )
-                if ip in network:
-                    return data
+        return None
+
+    def find_site_context(self, ip_address: str) -> Optional[Dict]:
+        """Find the precomputed site render context for a given IP address"""
+        with self.metrics.stage('network_config_load'):
+            if self.network_config.refresh():
+                self.metrics.count('network_config_reloads')
+                
+        import ipaddress
+        
+        try:
+            with self.metrics.stage('find_location'):
+                return self.network_config.find_site_context(ip_address, refresh=False)
                     
         except ipaddress.AddressValueError as e:
             self.logger.error(f"Invalid IP address {ip_address}: {e}")
             
         return None
 
-    def upload_with_sftp(self, local_file: str, remote_file: str) -> bool:
-        """Upload file to SFTP server"""
+    @timed_stage('sftp_put')
+    def _sftp_put(
+        self,
+        local_file: str,
+        remote_file: str,
+        hostname: Optional[str] = None,
+        output_hash: Optional[str] = None
+    ) -> None:
+        """Single SFTP upload attempt into the ztp directory; raises on failure
+        
+        With a hostname and output hash, each server that takes the file is
+        recorded in the manifest as soon as its own copy lands, including
+        copies that finish after the write policy was met.
+        """
+        remote_directory = "ztp"
+        remote_path = f"{remote_directory}/{remote_file}"
+        
+        def record(result: TargetResult) -> None:
+            if result.success:
+                self.manifest.record_upload(hostname, remote_file, result.host, output_hash)
+                
+        on_result = record if hostname and output_hash else None
+        results = self.uploader.put(local_file, remote_path, on_result=on_result)
+        hosts = ', '.join(result.host for result in results if result.success)
+        self.logger.info(f"Uploaded {local_file} to {hosts} as {remote_path}")
+
+    def _upload_func(self, hostname: Optional[str], output_hash: Optional[str]) -> Callable[[str, str], None]:
+        """Upload function for the scheduler that records each server's copy of this device's output"""
+        return lambda local_file, remote_file: self._sftp_put(local_file, remote_file, hostname, output_hash)
+
+    def queue_upload(
+        self,
+        local_file: str,
+        remote_file: str,
+        hostname: Optional[str] = None,
+        output_hash: Optional[str] = None
+    ) -> bool:
+        """Queue a file on the upload scheduler without waiting for it"""
         if not self.authenticated:
             self.logger.error("Cannot upload - not authenticated")
             return False
             
-        self.logger.info(f"Starting SFTP upload to {FTP_SERVER_IP}")
+        self.upload_scheduler.submit(
+            local_file, remote_file, upload_func=self._upload_func(hostname, output_hash)
+        )
+        return True
+
+    @timed_stage('bulk_upload')
+    def bulk_upload(self, files: List[Tuple[str, str]]) -> Dict[str, List[str]]:
+        """Upload many (local_file, remote_file) pairs into ztp/ in one transfer
         
-        try:
-            transport = paramiko.Transport((FTP_SERVER_IP, 22))
-            transport.connect(username=self.ftp_username, password=self.ftp_password)
-            sftp = paramiko.SFTPClient.from_transport(transport)
-            
-            remote_directory = "ztp"
-            remote_path = f"{remote_directory}/{remote_file}"
-            
-            sftp.put(local_file, remote_path)
-            sftp.close()
-            transport.close()
+        Sends a single tar archive to every target in parallel and extracts it
+        there. A server that will not run the extract gets pipelined puts over
+        one SFTP channel instead. Returns the hosts that received each remote
+        name; a name that reached none of them is left out.
+        """
+        if not self.authenticated:
+            self.logger.error("Cannot upload - not authenticated")
+            return {}
+        if not files:
+            return {}
             
-            self.logger.info(f"Uploaded {local_file} to {FTP_SERVER_IP} as {remote_path}")
-            return True
+        remote_directory = "ztp"
+        
+        def send(pool: SFTPSessionPool) -> List[str]:
+            try:
+                upload_archive(pool, files, remote_directory)
+                return []
+            except Exception as e:
+                self.logger.warning(f"Archive upload to {pool.host} failed ({e}), falling back to pipelined SFTP")
+            return upload_pipelined(pool, files, remote_directory)
             
-        except Exception as e:
-            self.logger.error(f"SFTP upload failed: {e}")
+        results = self.uploader.replicate(send, f"Bulk upload of {len(files)} files", wait_for_all=True)
+        delivered: Dict[str, List[str]] = {}
+        for result in results:
+            if result.success:
+                failed = set(result.value)
+                for _, remote_file in files:
+                    if remote_file not in failed:
+                        delivered.setdefault(remote_file, []).append(result.host)
+            else:
+                self.logger.error(f"Bulk SFTP upload to {result.host} failed: {result.error}")
+        return delivered
+
+    @timed_stage('upload_with_sftp')
+    def upload_with_sftp(
+        self,
+        local_file: str,
+        remote_file: str,
+        hostname: Optional[str] = None,
+        output_hash: Optional[str] = None
+    ) -> bool:
+        """Upload file to SFTP server, retrying with backoff on failure"""
+        if not self.authenticated:
+            self.logger.error("Cannot upload - not authenticated")
             return False
+            
+        self.logger.info(f"Starting SFTP upload to {self.uploader.host}")
+        
+        future = self.upload_scheduler.submit(
+            local_file, remote_file, track=False, upload_func=self._upload_func(hostname, output_hash)
+        )
+        result = future.result()
+        if not result.success:
+            self.logger.error(f"SFTP upload failed: {result.error}")
+        return result.success
+
+    def template_hash(self, model: str) -> str:
+        """Hash of a model's template and the templates it pulls in, recomputed only when a file changes"""
+        content_hash = self.template_catalog.closure_hash(model)
+        if content_hash is None:
+            raise FileNotFoundError(f"No template for model {model!r}")
+        return content_hash
 
+    @timed_stage('render_template')
     def render_template(
         self,
         model: str,
@@ -152,23 +677,26 @@ class NetworkConfigGenerator:
     ) -> str:
         """Render configuration template using Jinja2"""
         try:
-            env = Environment(loader=FileSystemLoader(TEMPLATES_PATH))
             template_file = f"{model}.j2"
-            template = env.get_template(template_file)
-            
-            return template.render(
-                model=model,
-                hostname=hostname,
-                ip_address=ip_address,
-                access_vlan_id=access_vlan_id,
-                access_vlan_name=access_vlan_name,
-                voice_vlan_id=voice_vlan_id,
-                voice_vlan_name=voice_vlan_name,
-                location=location,
-                gateway=gateway,
-                subnet=subnet,
-                ip_acl=ip_acl,
-            )
+            environment = self.get_environment()
+            template = environment.get_template(template_file)
+            
+            # Site and VLAN values are shared by every switch at a site, so the
+            # template is rendered once per combination and reused for the rest
+            site_values, device_values = split_values({
+                'model': model,
+                'hostname': hostname,
+                'ip_address': ip_address,
+                'access_vlan_id': access_vlan_id,
+                'access_vlan_name': access_vlan_name,
+                'voice_vlan_id': voice_vlan_id,
+                'voice_vlan_name': voice_vlan_name,
+                'location': location,
+                'gateway': gateway,
+                'subnet': subnet,
+                'ip_acl': ip_acl,
+            })
+            return self.site_templates.render(environment, template, site_values, device_values)
             
         except Exception as e:
             self.logger.error(f"Template rendering failed: {e}")
@@ -195,56 +723,149 @@ class NetworkConfigGenerator:
             self.logger.error(f"Failed to write CSV file: {e}")
             raise
 
-    def generate_configuration(self, data: Dict) -> bool:
-        """Generate and save network configuration"""
+    @staticmethod
+    def remote_filename_for(data: Dict) -> str:
+        """Name a device's file gets on the server: <mac>.py for ZTP, <hostname>-confg otherwise"""
+        if data.get('mac_address'):
+            return f"{data['mac_address']}.py"
+        return f"{data['hostname']}-confg"
+
+    def get_inventory(self) -> DeviceInventory:
+        """Local device inventory, opened on first use"""
+        if self._inventory is None:
+            self._inventory = DeviceInventory(INVENTORY_DB, self.network_config)
+        return self._inventory
+        
+    def get_ip_allocator(self) -> IPAllocator:
+        """Address allocator, seeded from the inventory and generated configs on first use"""
+        if self._ip_allocator is None:
+            self._ip_allocator = IPAllocator(ALLOCATIONS_FILE, self.network_config)
+            self._ip_allocator.seed_from_inventory(self.get_inventory())
+            self._ip_allocator.seed_from_configs(CONFIGS_PATH)
+        return self._ip_allocator
+        
+    def assign_address(self, data: Dict) -> None:
+        """Replace an 'auto' ip_address with the next free address of the device's site
+        
+        The site is the row's 'site' column, or its location when that names
+        a site in the network config. An explicit address is marked as used
+        once the allocator exists, so a later 'auto' row cannot be given it.
+        """
+        if data.get('ip_address', '').lower() != AUTO_ADDRESS:
+            if self._ip_allocator is not None and data.get('ip_address'):
+                self._ip_allocator.mark_used(data['ip_address'])
+            return
+        allocator = self.get_ip_allocator()
+        data['ip_address'] = allocator.allocate(site_for(data), data['hostname'])
+        allocator.save()
+        self.logger.info(f"Assigned {data['ip_address']} to {data['hostname']}")
+
+    @timed_stage('generate_configuration')
+    def generate_configuration(
+        self,
+        data: Dict,
+        wait_for_upload: bool = True,
+        force: bool = False
+    ) -> bool:
+        """Generate and save network configuration
+        
+        With wait_for_upload=False the upload is only queued, so the caller can
+        render the next device while this one transfers; collect the upload
+        outcome afterwards from upload_scheduler.wait().
+        
+        Devices whose inputs match the manifest are not re-rendered and
+        outputs the server already has are not re-uploaded, unless force is set.
+        """
         try:
-            with open(NETWORK_CONFIG_FILE, 'r') as json_file:
-                network_data = json.load(json_file)
-                
-            location_data = self.find_location(data['ip_address'], network_data)
+            self.assign_address(data)
+            site_context = self.find_site_context(data['ip_address'])
             
-            if not location_data:
+            if not site_context:
                 self.logger.error(f"No matching location found for IP: {data['ip_address']}")
+                self.metrics.count('devices_failed')
                 return False
                 
-            ip_octets = data['ip_address'].split('.')
-            ip_acl = '.'.join(ip_octets[:3])
-            
-            rendered_config = self.render_template(
-                model=data['model'],
-                hostname=data['hostname'],
-                ip_address=data['ip_address'],
-                access_vlan_id=data['access_vlan_id'],
-                access_vlan_name=data['access_vlan_name'],
-                voice_vlan_id=data['voice_vlan_id'],
-                voice_vlan_name=data['voice_vlan_name'],
-                location=data['location'],
-                gateway=location_data["gateway"],
-                subnet=location_data["subnet_mask"],
-                ip_acl=ip_acl
-            )
-            
-            local_filename = f"{data['hostname']}-confg"
+            hostname = data['hostname']
+            local_filename = f"{hostname}-confg"
             local_path = os.path.join(CONFIGS_PATH, local_filename)
+            input_hash = self.manifest.input_hash(
+                data, site_context, self.template_hash(data['model'])
+            )
             
-            with open(local_path, 'w') as local_file:
-                local_file.write(rendered_config)
-                
-            self.logger.info(f"Configuration saved to {local_path}")
+            if not force and self.manifest.is_current(hostname, input_hash) and os.path.exists(local_path):
+                self.logger.info(f"Configuration for {hostname} is up to date, skipping render")
+                self.metrics.count('renders_skipped')
+                output_hash = self.manifest.get(hostname)['output_hash']
+            else:
+                output_hash = self.render_to_file(data, site_context, local_path)
+                self.metrics.count('devices_rendered')
+                self.manifest.record_render(hostname, data['model'], input_hash, output_hash)
             
-            if data.get('upload') and self.authenticated:
-                remote_filename = (
-                    f"{data['mac_address']}.py" if data.get('mac_address') 
-                    else f"{data['hostname']}-confg"
-                )
-                return self.upload_with_sftp(local_path, remote_filename)
+            if data.get('upload'):
+                if not self.authenticated:
+                    self.logger.error(f"Cannot upload {hostname} - not authenticated")
+                    self.metrics.count('devices_failed')
+                    return False
+                remote_filename = self.remote_filename_for(data)
+                if not force and self.manifest.is_uploaded(hostname, remote_filename, UPLOAD_TARGETS):
+                    self.logger.info(f"{remote_filename} is unchanged on every server, skipping upload")
+                    self.metrics.count('uploads_skipped')
+                    return True
+                if not wait_for_upload:
+                    return self.queue_upload(local_path, remote_filename, hostname, output_hash)
+                return self.upload_with_sftp(local_path, remote_filename, hostname, output_hash)
             
             return True
                 
         except Exception as e:
             self.logger.error(f"Configuration generation failed: {e}")
+            self.metrics.count('devices_failed')
             return False
 
+    @staticmethod
+    def template_values(data: Dict, site_context: Dict) -> Dict[str, str]:
+        """Template variables for a device, from its inventory row and site context"""
+        return {
+            'model': data['model'],
+            'hostname': data['hostname'],
+            'ip_address': data['ip_address'],
+            'access_vlan_id': data['access_vlan_id'],
+            'access_vlan_name': data['access_vlan_name'],
+            'voice_vlan_id': data['voice_vlan_id'],
+            'voice_vlan_name': data['voice_vlan_name'],
+            'location': data['location'],
+            'gateway': site_context["gateway"],
+            'subnet': site_context["subnet"],
+            'ip_acl': site_context["ip_acl"],
+        }
+        
+    def render_config(self, data: Dict, site_context: Dict) -> str:
+        """Render a device's configuration from its inventory row and site context"""
+        return self.render_template(**self.template_values(data, site_context))
+        
+    def render_config_chunks(self, data: Dict, site_context: Dict) -> Iterator[str]:
+        """Like render_config, but yields the configuration piece by piece"""
+        environment = self.get_environment()
+        template = environment.get_template(f"{data['model']}.j2")
+        site_values, device_values = split_values(self.template_values(data, site_context))
+        return self.site_templates.generate(environment, template, site_values, device_values)
+        
+    def render_to_file(self, data: Dict, site_context: Dict, local_path: str) -> str:
+        """Render a device's configuration to local_path and return the output hash
+        
+        The output is streamed to the file and hashed as it is written, so the
+        whole configuration is never held in memory as one string.
+        """
+        output_hash = hashlib.sha256()
+        with self.metrics.stage('render_to_file'):
+            with open(local_path, 'w') as local_file:
+                for chunk in self.render_config_chunks(data, site_context):
+                    local_file.write(chunk)
+                    output_hash.update(chunk.encode())
+            
+        self.logger.info(f"Configuration saved to {local_path}")
+        return output_hash.hexdigest()
+
 class AuthenticationDialog:
     def __init__(self, parent):
         self.top = tk.Toplevel(parent)
@@ -312,7 +933,20 @@ class ConfigurationGUI:
             self.window.destroy()
             return
             
+        # Submissions are processed one at a time by a background worker;
+        # it reports back through result_queue, polled from the Tk main loop
+        self.job_queue: "queue.Queue[Optional[Tuple[int, Dict]]]" = queue.Queue()
+        self.result_queue: "queue.Queue[Tuple[str, int, Any]]" = queue.Queue()
+        self.job_ids = itertools.count(1)
+        self.pending_jobs: Dict[int, str] = {}
+        self.cancelled_jobs = set()
+        self.running_job: Optional[int] = None
+        self.worker = threading.Thread(target=self.process_jobs, daemon=True)
+        self.worker.start()
+            
         self.setup_ui()
+        self.window.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.window.after(100, self.poll_results)
         
     def authenticate(self) -> bool:
         """Show authentication dialog and verify credentials"""
@@ -351,6 +985,9 @@ class ConfigurationGUI:
         self.message_label = tk.Label(frame, text="", fg="green")
         self.message_label.grid(row=3, column=0, pady=10, padx=10)
         
+        # Background job progress
+        self.create_progress_display(frame)
+        
     def create_input_fields(self, parent):
         """Create input fields for network configuration"""
         # Hostname
@@ -395,17 +1032,14 @@ class ConfigurationGUI:
         """Create model selection combobox"""
         tk.Label(parent, text="Model").grid(row=18, column=2)
         self.model_var = tk.StringVar()
+        catalog = self.generator.template_catalog
+        for model, missing in catalog.incompatible().items():
+            self.generator.logger.warning(
+                f"{model} needs {', '.join(sorted(missing))}, which will render blank"
+            )
         model_combobox = ttk.Combobox(
             parent, 
-            values=[
-                "C9200L-24P-4X",
-                "C9300L-48P-4X",
-                "WS-C3650-48FD-L",
-                "ZTP-C9200L-24P-4X",
-                "ZTP-C9200L-24P-4X",
-                "ZTP-C9300-48P-UXM"
-
-            ], 
+            values=catalog.models(compatible_only=False),
             textvariable=self.model_var
         )
         model_combobox.grid(row=19, column=2)
@@ -423,6 +1057,107 @@ class ConfigurationGUI:
             row=2, column=0, sticky="sw", pady=10, padx=10
         )
         
+        # Cancel button for submissions that have not started yet
+        tk.Button(parent, text="Cancel queued", command=self.cancel_pending).grid(
+            row=2, column=0, sticky="se", pady=10, padx=10
+        )
+        
+    def create_progress_display(self, parent):
+        """Create the progress bar and queue status label"""
+        self.progress_bar = ttk.Progressbar(parent, mode="indeterminate", length=300)
+        self.progress_bar.grid(row=4, column=0, pady=5, padx=10)
+        
+        self.queue_label = tk.Label(parent, text="Idle")
+        self.queue_label.grid(row=5, column=0, pady=5, padx=10)
+        
+    def update_progress(self):
+        """Refresh the progress bar and queue status from the job bookkeeping"""
+        waiting = sum(
+            1 for job_id in self.pending_jobs
+            if job_id != self.running_job and job_id not in self.cancelled_jobs
+        )
+        
+        if self.running_job is not None:
+            hostname = self.pending_jobs.get(self.running_job, "")
+            self.queue_label.config(text=f"Processing {hostname} ({waiting} queued)")
+            self.progress_bar.start(10)
+        else:
+            self.queue_label.config(text=f"Idle ({waiting} queued)" if waiting else "Idle")
+            self.progress_bar.stop()
+            
+    def process_jobs(self):
+        """Background worker: save, generate and upload queued submissions in order"""
+        while True:
+            job = self.job_queue.get()
+            if job is None:
+                break
+                
+            job_id, config_data = job
+            if job_id in self.cancelled_jobs:
+                self.result_queue.put(("cancelled", job_id, None))
+                continue
+                
+            self.result_queue.put(("started", job_id, None))
+            try:
+                # Resolve an 'auto' address first so data.csv gets the real one
+                self.generator.assign_address(config_data)
+                self.generator.save_to_csv('data.csv', config_data)
+                success = self.generator.generate_configuration(config_data)
+                # Only devices that generated are recorded, as batch runs do
+                if success:
+                    self.generator.get_inventory().upsert(config_data)
+                self.result_queue.put(("finished", job_id, success))
+            except Exception as e:
+                self.result_queue.put(("failed", job_id, e))
+                
+    def poll_results(self):
+        """Apply worker results on the Tk thread, then reschedule"""
+        try:
+            while True:
+                event, job_id, value = self.result_queue.get_nowait()
+                hostname = self.pending_jobs.get(job_id, "")
+                
+                if event == "started":
+                    self.running_job = job_id
+                elif event == "cancelled":
+                    self.pending_jobs.pop(job_id, None)
+                    self.cancelled_jobs.discard(job_id)
+                elif event == "finished":
+                    self.running_job = None
+                    self.pending_jobs.pop(job_id, None)
+                    if value:
+                        self.message_label.config(text=f"{hostname}: operation completed successfully", fg="green")
+                    else:
+                        self.message_label.config(text=f"{hostname}: operation completed with warnings", fg="orange")
+                elif event == "failed":
+                    self.running_job = None
+                    self.pending_jobs.pop(job_id, None)
+                    self.generator.logger.error(f"Error in submit_data: {value}")
+                    self.message_label.config(text=f"{hostname}: operation failed", fg="red")
+                    messagebox.showerror("Error", f"An error occurred: {str(value)}")
+        except queue.Empty:
+            pass
+            
+        self.update_progress()
+        self.window.after(100, self.poll_results)
+        
+    def cancel_pending(self):
+        """Cancel every queued submission that the worker has not started"""
+        waiting = [
+            job_id for job_id in self.pending_jobs
+            if job_id != self.running_job and job_id not in self.cancelled_jobs
+        ]
+        self.cancelled_jobs.update(waiting)
+        if waiting:
+            self.message_label.config(text=f"Cancelled {len(waiting)} queued submission(s)", fg="orange")
+        self.update_progress()
+        
+    def on_close(self):
+        """Stop the worker and close the window"""
+        self.cancel_pending()
+        self.job_queue.put(None)
+        self.window.destroy()
+        
     def submit_data(self):
         """Handle form submission"""
         try:
@@ -435,6 +1170,17 @@ class ConfigurationGUI:
                 )
                 return
                 
+            catalog = self.generator.template_catalog
+            template = catalog.get(self.model_var.get())
+            if template is None:
+                self.message_label.config(text=catalog.problem(self.model_var.get()), fg="red")
+                return
+            if catalog.missing_variables(template) and not messagebox.askyesno(
+                "Incomplete template",
+                f"{catalog.problem(template.model)}.\n\nThose values will be blank. Generate anyway?"
+            ):
+                return
+                
             config_data = {
                 'hostname': self.hostname_var.get(),
                 'ip_address': self.ip_var.get(),
@@ -448,13 +1194,13 @@ class ConfigurationGUI:
                 'upload': bool(self.upload_var.get())
             }
             
-            self.generator.save_to_csv('data.csv', config_data)
-            success = self.generator.generate_configuration(config_data)
+            # Hand the work to the background worker so the window stays responsive
+            job_id = next(self.job_ids)
+            self.pending_jobs[job_id] = config_data['hostname']
+            self.job_queue.put((job_id, config_data))
             
-            if success:
-                self.message_label.config(text="Operation completed successfully", fg="green")
-            else:
-                self.message_label.config(text="Operation completed with warnings", fg="orange")
+            self.message_label.config(text=f"Queued {config_data['hostname']}", fg="green")
+            self.update_progress()
             
         except Exception as e:
             self.generator.logger.error(f"Error in submit_data: {e}")
@@ -465,13 +1211,928 @@ class ConfigurationGUI:
         """Run the application"""
         self.window.mainloop()
 
-if __name__ == "__main__":
-    os.makedirs(TEMPLATES_PATH, exist_ok=True)
-    os.makedirs(CONFIGS_PATH, exist_ok=True)
+def read_inventory(filename: str) -> Iterator[DeviceRecord]:
+    """Stream device rows from an inventory CSV as DeviceRecords
+    
+    Files may either start with a header row naming INVENTORY_FIELDS columns
+    (and optionally 'site'), or use the headerless data.csv column order.
+    Rows are read lazily, one at a time.
+    """
+    with open(filename, 'r', newline='') as file:
+        reader = csv.reader(file)
+        columns = INVENTORY_FIELDS
+        
+        for line_number, row in enumerate(reader, start=1):
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if line_number == 1 and row[0].strip().lower() == 'hostname':
+                columns = [cell.strip().lower() for cell in row]
+                continue
+                
+            yield DeviceRecord(**dict(zip(columns, (cell.strip() for cell in row))))
+
+
+def site_for(data: Dict) -> str:
+    """Network config site a row's address is allocated from"""
+    return data.get('site') or data.get('location', '')
+
+
+_template_catalog: Optional[TemplateCatalog] = None
+
+
+def get_template_catalog() -> TemplateCatalog:
+    """The process-wide catalog of TEMPLATES_PATH"""
+    global _template_catalog
+    if _template_catalog is None:
+        _template_catalog = TemplateCatalog(TEMPLATES_PATH, TEMPLATE_CATALOG_FILE, TEMPLATE_VARIABLES)
+    return _template_catalog
+
+
+def available_models() -> List[str]:
+    """Models that have a template in TEMPLATES_PATH, including incompatible ones"""
+    return get_template_catalog().models(compatible_only=False)
+
+
+def validate_inventory(
+    inventory_file: str,
+    max_issues: Optional[int] = None,
+    allow_incomplete: bool = False
+) -> List[ValidationIssue]:
+    """Check every row of an inventory file without rendering anything
+    
+    With allow_incomplete, models whose templates need variables the
+    generator does not provide are only warned about.
+    """
+    network_config = NetworkConfigLoader(NETWORK_CONFIG_FILE)
+    allocatable_sites = [
+        site for site, site_data in network_config.load().items() if site_data.get('hosts_range')
+    ]
+    validator = InventoryValidator(
+        network_config.index, get_template_catalog(), allocatable_sites, allow_incomplete
+    )
+    return validator.validate(read_inventory(inventory_file), max_issues)
+
+
+def report_issues(issues: List[ValidationIssue], limit: int = 50) -> None:
+    """Print validation issues, at most limit of them"""
+    for issue in issues[:limit]:
+        print(issue)
+    if len(issues) > limit:
+        print(f"... and {len(issues) - limit} more")
+    rows = len({issue.row for issue in issues})
+    print(f"Validation failed: {len(issues)} issue(s) in {rows} row(s)")
+
+
+def prepare_allocator(inventory_file: str) -> Optional[IPAllocator]:
+    """Allocator for an inventory's 'auto' rows, or None if it has none
+    
+    Every explicit address in the inventory file, the device inventory and
+    the generated configs is marked as used first, so no allocated address
+    clashes with one of them.
+    """
+    explicit = []
+    auto_rows = 0
+    for data in read_inventory(inventory_file):
+        if data['ip_address'].lower() == AUTO_ADDRESS:
+            auto_rows += 1
+        else:
+            explicit.append(data['ip_address'])
+    if not auto_rows:
+        return None
+        
+    allocator = IPAllocator(ALLOCATIONS_FILE, NetworkConfigLoader(NETWORK_CONFIG_FILE))
+    allocator.seed(explicit)
+    if os.path.exists(INVENTORY_DB):
+        inventory = DeviceInventory(INVENTORY_DB)
+        try:
+            allocator.seed_from_inventory(inventory)
+        finally:
+            inventory.close()
+    allocator.seed_from_configs(CONFIGS_PATH)
+    logging.getLogger(__name__).info(f"Allocating addresses for {auto_rows} devices")
+    return allocator
+
+
+def allocate_addresses(rows: Iterable[Dict], allocator: Optional[IPAllocator]) -> Iterator[Dict]:
+    """Fill in 'auto' addresses as rows stream past, before they reach the workers"""
+    for data in rows:
+        if allocator and data['ip_address'].lower() == AUTO_ADDRESS:
+            try:
+                data['ip_address'] = allocator.allocate(site_for(data), data['hostname'])
+            except ValueError as e:
+                logging.getLogger(__name__).error(f"Cannot allocate an address for {data['hostname']}: {e}")
+        yield data
+
+
+def ordered_map(
+    executor,
+    func: Callable,
+    items: Iterable,
+    window: int
+) -> Iterator[Tuple[Any, Any]]:
+    """Like executor.map, but keeps at most `window` items in flight
+    
+    Yields (item, result) pairs in input order, so the inventory is streamed
+    rather than read into memory up front.
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(func, item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+            
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+# Per-process generator used by batch workers
+_batch_generator: Optional[NetworkConfigGenerator] = None
+_batch_options: Dict[str, bool] = {'wait_for_upload': True, 'force': False}
+_batch_in_subprocess = False
+
+
+def _init_batch_worker(
+    username: Optional[str],
+    password: Optional[str],
+    wait_for_upload: bool = True,
+    force: bool = False,
+    timing_log: Optional[str] = None,
+    in_subprocess: bool = False
+) -> None:
+    """Create the worker's generator and log in once if uploads are enabled
+    
+    If the login fails every device the worker is given fails its upload.
+    """
+    global _batch_generator, _batch_in_subprocess
+    _batch_generator = NetworkConfigGenerator(timing_log)
+    _batch_in_subprocess = in_subprocess
+    # The batch owner saves the manifest once at the end of the run
+    _batch_generator.manifest.autosave = False
+    _batch_options.update(wait_for_upload=wait_for_upload, force=force)
+    if username and password:
+        _batch_generator.authenticate(username, password)
+
+
+def _generate_batch_device(data: Dict) -> Tuple[bool, Optional[Dict], Optional[Dict]]:
+    """Batch worker entry point: generate one device with the worker's generator
+    
+    Returns the device's manifest entry and, in worker processes, the timing
+    samples recorded since the last device, so the parent can fold the
+    worker's bookkeeping into its own.
+    """
+    success = _batch_generator.generate_configuration(data, **_batch_options)
+    metrics = _batch_generator.metrics.drain() if _batch_in_subprocess else None
+    return success, _batch_generator.manifest.get(data['hostname']), metrics
+
+
+def run_batch(
+    inventory_file: str,
+    workers: int = 4,
+    use_processes: bool = False,
+    upload: bool = False,
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    force: bool = False,
+    timing_log: Optional[str] = None,
+    bulk_upload: bool = False,
+    validate: bool = True,
+    allow_incomplete: bool = False
+) -> Tuple[int, int]:
+    """Generate configurations for every device in an inventory file
+    
+    Returns a (succeeded, failed) tuple. Progress is printed in inventory
+    order regardless of the order in which the workers finish. Devices that
+    are unchanged since the last run are skipped unless force is set.
+    Per-stage timing percentiles are logged once the run has finished.
+    
+    With bulk_upload, workers only render; the changed files are then sent
+    to the server as one archive once every device has been generated.
+    
+    Unless validate is False the whole inventory is checked first, and
+    nothing is rendered or uploaded if any row has a problem; the failed
+    count is then the number of rows with issues. allow_incomplete lets
+    rows through whose template needs variables that are never provided.
+    
+    With upload set, a failed login fails the batch: in thread mode it is
+    aborted before anything is rendered, and in process mode every device
+    handled by a worker that could not log in is counted as failed.
+    
+    Every successfully generated device is upserted into the device
+    inventory at INVENTORY_DB.
+    """
+    if validate:
+        issues = validate_inventory(inventory_file, allow_incomplete=allow_incomplete)
+        if issues:
+            report_issues(issues)
+            return 0, len({issue.row for issue in issues})
+            
+    if not upload:
+        username = password = None
+        bulk_upload = False
+    # In bulk mode the workers never upload, so they do not need to log in
+    worker_username, worker_password = (None, None) if bulk_upload else (username, password)
+        
+    if use_processes:
+        # Each process uploads its own devices over its own session pool
+        from concurrent.futures import ProcessPoolExecutor
+        
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_batch_worker,
+            initargs=(worker_username, worker_password, True, force, timing_log, True)
+        )
+        manifest = GenerationManifest(MANIFEST_FILE, autosave=False)
+        metrics = StageMetrics()
+    else:
+        # Threads share one generator, so its caches and upload queue are
+        # shared too; uploads overlap with rendering the following devices
+        _init_batch_worker(worker_username, worker_password, False, force, timing_log)
+        if worker_username and not _batch_generator.authenticated:
+            _batch_generator.close()
+            device_count = sum(1 for _ in read_inventory(inventory_file))
+            print(f"Batch aborted: could not log in to {', '.join(UPLOAD_TARGETS)}")
+            return 0, device_count
+        executor = ThreadPoolExecutor(max_workers=workers)
+        manifest = _batch_generator.manifest
+        metrics = _batch_generator.metrics
+        
+    # Addresses are allocated here rather than in the workers so that
+    # worker processes never hand out the same address twice
+    allocator = prepare_allocator(inventory_file)
+    
+    def rows() -> Iterator[DeviceRecord]:
+        for data in allocate_addresses(read_inventory(inventory_file), allocator):
+            data['upload'] = upload and not bulk_upload
+            yield data
+            
+    succeeded = 0
+    failures = []
+    bulk_files: List[Tuple[str, str, str]] = []
+    inventory = DeviceInventory(INVENTORY_DB, NetworkConfigLoader(NETWORK_CONFIG_FILE))
+    generated_rows: List[Dict] = []
+    
+    with executor:
+        results = ordered_map(executor, _generate_batch_device, rows(), window=workers * 4)
+        for count, (data, (success, manifest_entry, worker_metrics)) in enumerate(results, start=1):
+            if use_processes:
+                manifest.put(data['hostname'], manifest_entry)
+                metrics.merge(worker_metrics)
+            if success:
+                succeeded += 1
+                generated_rows.append(data)
+                if len(generated_rows) >= 1000:
+                    inventory.upsert_many(generated_rows)
+                    generated_rows = []
+                if bulk_upload:
+                    remote_file = NetworkConfigGenerator.remote_filename_for(data)
+                    if force or not manifest.is_uploaded(data['hostname'], remote_file, UPLOAD_TARGETS):
+                        output_hash = manifest.get(data['hostname'])['output_hash']
+                        bulk_files.append((data['hostname'], remote_file, output_hash))
+            else:
+                failures.append(data['hostname'])
+            print(f"[{count}] {data['hostname']}: {'ok' if success else 'FAILED'}")
+    
+    if not use_processes:
+        scheduler = _batch_generator.upload_scheduler
+        if scheduler:
+            for result in scheduler.wait():
+                if not result.success:
+                    succeeded -= 1
+                    failures.append(result.remote_file)
+                    print(f"[upload] {result.remote_file}: FAILED ({result.error})")
+                    
+    if bulk_files:
+        uploader = _batch_generator if not use_processes else NetworkConfigGenerator(timing_log)
+        delivered: Dict[str, List[str]] = {}
+        if uploader.authenticate(username, password):
+            delivered = uploader.bulk_upload([
+                (os.path.join(CONFIGS_PATH, f"{hostname}-confg"), remote_file)
+                for hostname, remote_file, _ in bulk_files
+            ])
+            
+        uploaded = 0
+        for hostname, remote_file, output_hash in bulk_files:
+            hosts = delivered.get(remote_file, [])
+            for host in hosts:
+                manifest.record_upload(hostname, remote_file, host, output_hash)
+            if uploader.uploader and len(hosts) >= uploader.uploader.required:
+                uploaded += 1
+            else:
+                succeeded -= 1
+                failures.append(remote_file)
+                print(f"[upload] {remote_file}: FAILED")
+        print(f"Bulk upload: {uploaded} of {len(bulk_files)} files uploaded")
+        
+        if use_processes:
+            metrics.merge(uploader.metrics.drain())
+            uploader.close()
+            
+    if not use_processes:
+        _batch_generator.close()
+    inventory.upsert_many(generated_rows)
+    inventory.close()
+    manifest.save()
+    if allocator:
+        allocator.save()
+    metrics.log_summary(logging.getLogger(__name__))
+            
+    print(f"Batch complete: {succeeded} succeeded, {len(failures)} failed")
+    if failures:
+        print(f"Failed devices: {', '.join(failures)}")
+        
+    return succeeded, len(failures)
+
+
+# Per-process generator used by render engine workers
+_render_generator: Optional[NetworkConfigGenerator] = None
+_render_force = False
+
+
+def _init_render_worker(force: bool = False, timing_log: Optional[str] = None) -> None:
+    """Build the worker's generator and warm its network config and templates once"""
+    global _render_generator, _render_force
+    _render_generator = NetworkConfigGenerator(timing_log)
+    _render_force = force
+    
+    _render_generator.network_config.refresh()
+    environment = _render_generator.get_environment()
+    for model in available_models():
+        environment.get_template(f"{model}.j2")
+
+
+def _render_chunk(rows: List[Dict]) -> Tuple[List[Tuple[str, Optional[str], Optional[str]]], Dict]:
+    """Render engine worker entry point: render a chunk of devices without writing them
+    
+    Returns one (status, input_hash, rendered text) per row, status being
+    'rendered', 'skipped' or 'failed', plus the worker's timing samples.
+    """
+    generator = _render_generator
+    results = []
+    for data in rows:
+        try:
+            site_context = generator.find_site_context(data['ip_address'])
+            if not site_context:
+                generator.logger.error(f"No matching location found for IP: {data['ip_address']}")
+                results.append(('failed', None, None))
+                continue
+                
+            input_hash = generator.manifest.input_hash(
+                data, site_context, generator.template_hash(data['model'])
+            )
+            local_path = os.path.join(CONFIGS_PATH, f"{data['hostname']}-confg")
+            if (not _render_force and generator.manifest.is_current(data['hostname'], input_hash)
+                    and os.path.exists(local_path)):
+                results.append(('skipped', input_hash, None))
+                continue
+                
+            results.append(('rendered', input_hash, generator.render_config(data, site_context)))
+        except Exception as e:
+            generator.logger.error(f"Rendering {data.get('hostname')} failed: {e}")
+            results.append(('failed', None, None))
+    return results, generator.metrics.drain()
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists of at most size items"""
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 
-    generator = NetworkConfigGenerator()
+def render_fleet(
+    inventory_file: str,
+    workers: int = os.cpu_count() or 4,
+    chunk_size: int = 256,
+    force: bool = False,
+    timing_log: Optional[str] = None,
+    validate: bool = True,
+    allow_incomplete: bool = False
+) -> Tuple[int, int]:
+    """Render every device in an inventory across a process pool, without uploading
+    
+    The inventory is split into chunks of chunk_size rows so each task
+    amortises its inter-process overhead over many devices. Workers only
+    render; the rendered text comes back to this process, which is the
+    single writer of the config files, the manifest and the device
+    inventory. Chunks are written in inventory order, and the files are
+    byte-for-byte what a serial run writes. Returns (succeeded, failed).
+    allow_incomplete is passed on to the up-front validation.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    
+    if validate:
+        issues = validate_inventory(inventory_file, allow_incomplete=allow_incomplete)
+        if issues:
+            report_issues(issues)
+            return 0, len({issue.row for issue in issues})
+            
+    logger = logging.getLogger(__name__)
+    manifest = GenerationManifest(MANIFEST_FILE, autosave=False)
+    metrics = StageMetrics(timing_log)
+    inventory = DeviceInventory(INVENTORY_DB, NetworkConfigLoader(NETWORK_CONFIG_FILE))
+    allocator = prepare_allocator(inventory_file)
+    
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_render_worker,
+        initargs=(force, timing_log)
+    )
+    chunks = chunked(allocate_addresses(read_inventory(inventory_file), allocator), chunk_size)
+    succeeded = 0
+    failures = []
+    
+    with executor:
+        # A few chunks per worker in flight keeps every core busy while bounding memory
+        for rows, (results, worker_metrics) in ordered_map(executor, _render_chunk, chunks, window=workers * 2):
+            metrics.merge(worker_metrics)
+            generated_rows = []
+            for data, (status, input_hash, rendered) in zip(rows, results):
+                hostname = data['hostname']
+                if status == 'failed':
+                    failures.append(hostname)
+                    metrics.count('devices_failed')
+                    continue
+                    
+                if status == 'rendered':
+                    with metrics.stage('write_config'):
+                        with open(os.path.join(CONFIGS_PATH, f"{hostname}-confg"), 'w') as local_file:
+                            local_file.write(rendered)
+                    manifest.record_render(hostname, data['model'], input_hash, manifest.output_hash(rendered))
+                    metrics.count('devices_rendered')
+                else:
+                    metrics.count('renders_skipped')
+                succeeded += 1
+                generated_rows.append(data)
+                
+            inventory.upsert_many(generated_rows)
+            logger.info(f"Rendered {succeeded + len(failures)} devices")
+            
+    inventory.close()
+    manifest.save()
+    if allocator:
+        allocator.save()
+    metrics.log_summary(logger)
+    metrics.close()
+    
+    print(f"Render complete: {succeeded} succeeded, {len(failures)} failed")
+    if failures:
+        print(f"Failed devices: {', '.join(failures)}")
+    return succeeded, len(failures)
+
+
+def run_gui(timing_log: Optional[str] = None) -> None:
+    """Start the interactive configuration GUI"""
+    load_tkinter()
+    generator = NetworkConfigGenerator(timing_log)
     app = ConfigurationGUI(generator)
     
     # Only run if authentication was successful
     if hasattr(app, 'window'):
-        app.run()
\ No newline at end of file
+        app.run()
+    generator.metrics.log_summary(generator.logger)
+    generator.close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Command line options for main()"""
+    parser = argparse.ArgumentParser(description="Network switch configuration generator")
+    parser.add_argument(
+        '--timing-log', metavar='PATH',
+        help="Append one JSON line per timed stage to PATH"
+    )
+    parser.add_argument(
+        '--profile', metavar='PATH', nargs='?', const='config_gen.prof',
+        help="Run under cProfile and write the stats to PATH (default config_gen.prof); "
+             "worker processes are not profiled"
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    
+    compile_parser = subparsers.add_parser(
+        'compile-templates',
+        help="Precompile templates into Python modules for the packaged build"
+    )
+    compile_parser.add_argument(
+        '--target', default=COMPILED_TEMPLATES_PATH,
+        help="Output directory; bundle it as 'compiled_templates' with PyInstaller"
+    )
+    
+    validate_parser = subparsers.add_parser(
+        'validate', help="Check an inventory CSV for errors and duplicates without rendering"
+    )
+    validate_parser.add_argument('inventory', help="Inventory CSV in data.csv column order")
+    validate_parser.add_argument(
+        '--allow-incomplete', action='store_true',
+        help="Accept models whose templates use variables that are never provided (rendered blank)"
+    )
+    
+    inventory_parser = subparsers.add_parser(
+        'inventory', help="Query, import or export the local device inventory"
+    )
+    inventory_actions = inventory_parser.add_subparsers(dest='inventory_action', required=True)
+    inventory_actions.add_parser(
+        'import', help="Upsert every row of an inventory CSV"
+    ).add_argument('file')
+    inventory_actions.add_parser(
+        'export', help="Write the inventory to a CSV with a header row"
+    ).add_argument('file')
+    inventory_actions.add_parser(
+        'show', help="Show the device with this hostname, IP or MAC address"
+    ).add_argument('key')
+    inventory_actions.add_parser(
+        'subnet', help="List the devices in a subnet, e.g. 172.17.4.0/22"
+    ).add_argument('cidr')
+    inventory_actions.add_parser(
+        'site', help="List the devices at a network config site"
+    ).add_argument('site')
+    
+    regenerate_parser = subparsers.add_parser(
+        'regenerate', help="Generate configurations for devices already in the inventory"
+    )
+    regenerate_parser.add_argument('hostnames', nargs='+')
+    regenerate_parser.add_argument('--upload', action='store_true', help="Upload each configuration over SFTP")
+    regenerate_parser.add_argument('--force', action='store_true', help="Re-render even if unchanged")
+    regenerate_parser.add_argument(
+        '--username', default=os.environ.get('username'),
+        help="SFTP username (defaults to the 'username' environment variable)"
+    )
+    
+    ztp_parser = subparsers.add_parser(
+        'serve-ztp', help="Serve ZTP scripts for inventory devices over HTTP, rendered on demand"
+    )
+    ztp_parser.add_argument('--host', default='0.0.0.0', help="Address to listen on")
+    ztp_parser.add_argument('--port', type=int, default=8080, help="Port to listen on")
+    ztp_parser.add_argument(
+        '--preload', action='store_true',
+        help="Render every inventory device with a MAC address before serving"
+    )
+    ztp_parser.add_argument(
+        '--allow-incomplete', action='store_true',
+        help="Also serve models whose templates use variables that are never provided"
+    )
+    
+    watch_parser = subparsers.add_parser(
+        'watch', help="Re-render affected devices whenever templates or the network config change"
+    )
+    watch_parser.add_argument(
+        '--inventory', help="Inventory CSV to watch for (defaults to the local device inventory)"
+    )
+    watch_parser.add_argument('--upload', action='store_true', help="Upload re-rendered configurations")
+    watch_parser.add_argument('--interval', type=float, default=1.0, help="Seconds between polls")
+    watch_parser.add_argument(
+        '--debounce', type=float, default=1.0,
+        help="Wait until files have been quiet this many seconds before re-rendering"
+    )
+    watch_parser.add_argument(
+        '--username', default=os.environ.get('username'),
+        help="SFTP username (defaults to the 'username' environment variable)"
+    )
+    
+    render_parser = subparsers.add_parser(
+        'render', help="Render a whole inventory across a process pool, without uploading"
+    )
+    render_parser.add_argument('inventory', help="Inventory CSV in data.csv column order")
+    render_parser.add_argument(
+        '--workers', type=int, default=os.cpu_count() or 4,
+        help="Number of worker processes"
+    )
+    render_parser.add_argument(
+        '--chunk-size', type=int, default=256,
+        help="Devices sent to a worker per task"
+    )
+    render_parser.add_argument('--force', action='store_true', help="Re-render unchanged devices too")
+    render_parser.add_argument(
+        '--skip-validation', action='store_true',
+        help="Start rendering without checking the whole inventory first"
+    )
+    render_parser.add_argument(
+        '--allow-incomplete', action='store_true',
+        help="Accept models whose templates use variables that are never provided (rendered blank)"
+    )
+    
+    batch_parser = subparsers.add_parser(
+        'batch', help="Generate configurations for every device in an inventory CSV"
+    )
+    batch_parser.add_argument('inventory', help="Inventory CSV in data.csv column order")
+    batch_parser.add_argument(
+        '--workers', type=int, default=os.cpu_count() or 4,
+        help="Number of concurrent workers"
+    )
+    batch_parser.add_argument(
+        '--processes', action='store_true',
+        help="Use a process pool instead of a thread pool"
+    )
+    batch_parser.add_argument('--upload', action='store_true', help="Upload each configuration over SFTP")
+    batch_parser.add_argument(
+        '--bulk-upload', action='store_true',
+        help="With --upload, send all changed files as one archive after rendering"
+    )
+    batch_parser.add_argument(
+        '--force', action='store_true',
+        help="Re-render and re-upload every device, ignoring the manifest"
+    )
+    batch_parser.add_argument(
+        '--skip-validation', action='store_true',
+        help="Start rendering without checking the whole inventory first"
+    )
+    batch_parser.add_argument(
+        '--allow-incomplete', action='store_true',
+        help="Accept models whose templates use variables that are never provided (rendered blank)"
+    )
+    batch_parser.add_argument(
+        '--username', default=os.environ.get('username'),
+        help="SFTP username (defaults to the 'username' environment variable)"
+    )
+    
+    return parser
+
+
+def main(argv=None) -> int:
+    """Command line entry point; runs the GUI when no command is given"""
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    
+    os.makedirs(TEMPLATES_PATH, exist_ok=True)
+    os.makedirs(CONFIGS_PATH, exist_ok=True)
+    
+    if args.profile:
+        import cProfile
+        
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(run_command, args)
+        finally:
+            profiler.dump_stats(args.profile)
+            logging.getLogger(__name__).info(f"Profile written to {args.profile}")
+    return run_command(args)
+
+
+def run_inventory_command(args: argparse.Namespace) -> int:
+    """Run one of the 'inventory' sub-commands"""
+    inventory = DeviceInventory(INVENTORY_DB, NetworkConfigLoader(NETWORK_CONFIG_FILE))
+    try:
+        if args.inventory_action == 'import':
+            count = inventory.upsert_many(read_inventory(args.file))
+            print(f"Imported {count} devices from {args.file}")
+            return 0
+        if args.inventory_action == 'export':
+            count = inventory.export_csv(args.file)
+            print(f"Exported {count} devices to {args.file}")
+            return 0
+            
+        if args.inventory_action == 'show':
+            device = inventory.get(args.key) or inventory.find_by_mac(args.key)
+            devices = [device] if device else inventory.find_by_ip(args.key)
+        elif args.inventory_action == 'subnet':
+            devices = inventory.in_subnet(args.cidr)
+        else:
+            devices = inventory.by_site(args.site)
+            
+        writer = csv.writer(sys.stdout)
+        writer.writerow(DEVICE_FIELDS)
+        for device in devices:
+            writer.writerow([device[field] for field in DEVICE_FIELDS])
+        return 0 if devices else 1
+    finally:
+        inventory.close()
+
+
+def run_regenerate(args: argparse.Namespace) -> int:
+    """Regenerate (and optionally upload) devices looked up in the inventory by hostname"""
+    generator = NetworkConfigGenerator(args.timing_log)
+    # Written once at the end rather than after every device
+    generator.manifest.autosave = False
+    failed = 0
+    try:
+        if args.upload:
+            password = os.environ.get('passwordAD') or getpass.getpass("SFTP password: ")
+            if not generator.authenticate(args.username, password):
+                return 1
+                
+        for hostname in args.hostnames:
+            data = generator.get_inventory().get(hostname)
+            if data is None:
+                print(f"{hostname}: not in the inventory")
+                failed += 1
+                continue
+            success = generator.generate_configuration(dict(data, upload=args.upload), force=args.force)
+            failed += not success
+            print(f"{hostname}: {'ok' if success else 'FAILED'}")
+    finally:
+        generator.close()
+        generator.manifest.save()
+    return 1 if failed else 0
+
+
+def resolve_ztp_request(generator: NetworkConfigGenerator, name: str, allow_incomplete: bool = False):
+    """Map a requested file name to (hostname, input hash, render callable)
+    
+    <mac>.py is looked up by MAC address and <hostname>-confg by hostname;
+    any other name is tried as a hostname, then as a MAC. Returns None for
+    devices that are not in the inventory or not in a known subnet, and,
+    unless allow_incomplete is set, for models whose template needs
+    variables the generator does not provide.
+    """
+    inventory = generator.get_inventory()
+    if name.endswith('.py'):
+        data = inventory.find_by_mac(name[:-3])
+    elif name.endswith('-confg'):
+        data = inventory.get(name[:-len('-confg')])
+    else:
+        data = inventory.get(name) or inventory.find_by_mac(name)
+    if data is None:
+        return None
+        
+    catalog = generator.template_catalog
+    template = catalog.get(data['model'])
+    if template is None or (catalog.missing_variables(template) and not allow_incomplete):
+        generator.logger.warning(f"Not serving {name}: {catalog.problem(data['model'])}")
+        return None
+        
+    site_context = generator.find_site_context(data['ip_address'])
+    if not site_context:
+        return None
+    version = generator.manifest.input_hash(data, site_context, generator.template_hash(data['model']))
+    return data['hostname'], version, lambda: generator.render_config(data, site_context)
+
+
+def run_ztp_server(args: argparse.Namespace) -> int:
+    """Serve ZTP scripts and configurations for inventory devices over HTTP until interrupted"""
+    from ztp_server import ZTPServer
+    
+    generator = NetworkConfigGenerator(args.timing_log)
+    server = ZTPServer(
+        lambda name: resolve_ztp_request(generator, name, args.allow_incomplete),
+        host=args.host, port=args.port
+    )
+    if args.preload:
+        # Warm the cache so the first boot of every ZTP switch is a memory hit
+        for data in generator.get_inventory():
+            if data['mac_address']:
+                resolved = resolve_ztp_request(generator, f"{data['mac_address']}.py", args.allow_incomplete)
+                if resolved:
+                    server.cache.get_or_render(*resolved)
+        generator.logger.info(f"Preloaded {len(server.cache)} ZTP scripts")
+        
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        generator.logger.info(
+            f"ZTP server stopped: {server.cache.hits} cache hits, {server.cache.renders} renders"
+        )
+        generator.metrics.log_summary(generator.logger)
+        generator.close()
+    return 0
+
+
+def run_watch(args: argparse.Namespace) -> int:
+    """Re-render the devices affected by each change to the templates or network config"""
+    from watch import DependencyGraph, FileWatcher
+    
+    generator = NetworkConfigGenerator(args.timing_log)
+    logger = generator.logger
+    # Saved once per change batch; rewriting it per device is quadratic
+    generator.manifest.autosave = False
+    if args.upload:
+        password = os.environ.get('passwordAD') or getpass.getpass("SFTP password: ")
+        if not generator.authenticate(args.username, password):
+            generator.close()
+            return 1
+            
+    def build_graph() -> DependencyGraph:
+        # Re-read every time so devices added since the last change are included
+        devices = read_inventory(args.inventory) if args.inventory else generator.get_inventory()
+        return DependencyGraph(devices, generator.network_config.index, generator.get_environment())
+        
+    network_data = generator.network_config.load()
+    graph = build_graph()
+    watcher = FileWatcher([TEMPLATES_PATH], [NETWORK_CONFIG_FILE], suffix='.j2')
+    logger.info(
+        f"Watching {TEMPLATES_PATH} and {NETWORK_CONFIG_FILE} for {len(graph.devices)} devices"
+    )
+    
+    try:
+        while True:
+            changed = watcher.wait_for_changes(args.interval, args.debounce)
+            started = time.monotonic()
+            
+            templates = [
+                os.path.relpath(path, TEMPLATES_PATH).replace(os.sep, '/')
+                for path in changed if path != NETWORK_CONFIG_FILE
+            ]
+            affected = graph.affected_by_templates(templates)
+            if NETWORK_CONFIG_FILE in changed:
+                try:
+                    generator.network_config.refresh()
+                except ValueError as e:
+                    logger.error(f"Ignoring unreadable {NETWORK_CONFIG_FILE}: {e}")
+                else:
+                    old_data, network_data = network_data, generator.network_config.load()
+                    affected |= graph.affected_by_network_config(
+                        old_data, network_data, generator.network_config.index
+                    )
+                    
+            graph = build_graph()
+            failed = []
+            for hostname in sorted(affected, key=str.lower):
+                data = graph.devices.get(hostname)
+                if data is None:
+                    continue
+                if not generator.generate_configuration(dict(data, upload=args.upload)):
+                    failed.append(hostname)
+            generator.manifest.save()
+                    
+            names = ', '.join(sorted(os.path.basename(path) for path in changed))
+            logger.info(
+                f"{names} changed: re-rendered {len(affected) - len(failed)} of {len(affected)} "
+                f"affected devices in {time.monotonic() - started:.2f}s"
+            )
+            if failed:
+                logger.error(f"Failed devices: {', '.join(failed)}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        generator.metrics.log_summary(logger)
+        generator.close()
+        generator.manifest.save()
+    return 0
+
+
+def run_command(args: argparse.Namespace) -> int:
+    """Run the command selected on the command line"""
+    if args.command == 'compile-templates':
+        try:
+            count = compile_templates(args.target)
+        except ValueError as e:
+            print(e)
+            return 1
+        print(f"Compiled {count} templates into {args.target}")
+        return 0
+        
+    if args.command == 'validate':
+        issues = validate_inventory(args.inventory, allow_incomplete=args.allow_incomplete)
+        if issues:
+            report_issues(issues)
+            return 1
+        print(f"{args.inventory}: no problems found")
+        return 0
+        
+    if args.command == 'inventory':
+        return run_inventory_command(args)
+        
+    if args.command == 'render':
+        _, failed = render_fleet(
+            args.inventory,
+            workers=max(1, args.workers),
+            chunk_size=max(1, args.chunk_size),
+            force=args.force,
+            timing_log=args.timing_log,
+            validate=not args.skip_validation,
+            allow_incomplete=args.allow_incomplete
+        )
+        return 1 if failed else 0
+        
+    if args.command == 'watch':
+        return run_watch(args)
+        
+    if args.command == 'serve-ztp':
+        return run_ztp_server(args)
+        
+    if args.command == 'regenerate':
+        return run_regenerate(args)
+        
+    if args.command == 'batch':
+        password = None
+        if args.upload:
+            password = os.environ.get('passwordAD') or getpass.getpass("SFTP password: ")
+        _, failed = run_batch(
+            args.inventory,
+            workers=max(1, args.workers),
+            use_processes=args.processes,
+            upload=args.upload,
+            username=args.username,
+            password=password,
+            force=args.force,
+            timing_log=args.timing_log,
+            bulk_upload=args.bulk_upload,
+            validate=not args.skip_validation,
+            allow_incomplete=args.allow_incomplete
+        )
+        return 1 if failed else 0
+        
+    run_gui(args.timing_log)
+    return 0
+
+if __name__ == "__main__":
+    # Required for process pools in the PyInstaller build
+    import multiprocessing
+    
+    multiprocessing.freeze_support()
+    sys.exit(main())
\ No newline at end of file
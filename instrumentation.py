@@ -0,0 +1,150 @@
+import functools
+import json
+import math
+import logging
+import threading
+import time
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return 0.0
+    rank = min(len(sorted_samples), max(1, math.ceil(fraction * len(sorted_samples)))) - 1
+    return sorted_samples[rank]
+
+
+class StageMetrics:
+    """Per-stage timers and counters for a generation run
+
+    Every timed stage keeps its individual durations, packed as doubles, so
+    percentiles can be reported at the end of a run. When timing_log is set, each sample is also
+    appended to that file as one JSON object per line.
+    """
+
+    def __init__(self, timing_log: Optional[str] = None):
+        self.timing_log = timing_log
+        self._samples: Dict[str, array] = defaultdict(lambda: array('d'))
+        self._counters: Dict[str, int] = defaultdict(int)
+        # How much of each stage / counter has already been handed out by drain()
+        self._drained_samples: Dict[str, int] = defaultdict(int)
+        self._drained_counters: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._log_file = None
+
+    def _write_log(self, record: Dict) -> None:
+        with self._lock:
+            if self._log_file is None:
+                self._log_file = open(self.timing_log, 'a', buffering=1)
+            self._log_file.write(json.dumps(record) + "\n")
+
+    def record(self, stage: str, duration: float, **fields) -> None:
+        """Add one timing sample for a stage"""
+        with self._lock:
+            self._samples[stage].append(duration)
+        if self.timing_log:
+            self._write_log(dict(
+                fields, stage=stage, duration_ms=round(duration * 1000, 3), ts=time.time()
+            ))
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        """Time the enclosed block as one sample of stage `name`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, **fields)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def drain(self) -> Dict:
+        """Return the samples and counts recorded since the last drain
+
+        Worker processes use this to ship their measurements to the parent,
+        which folds them in with merge().
+        """
+        drained = {'samples': {}, 'counters': {}}
+        with self._lock:
+            for stage, samples in self._samples.items():
+                offset = self._drained_samples[stage]
+                if offset < len(samples):
+                    drained['samples'][stage] = samples[offset:].tolist()
+                    self._drained_samples[stage] = len(samples)
+            for name, amount in self._counters.items():
+                delta = amount - self._drained_counters[name]
+                if delta:
+                    drained['counters'][name] = delta
+                    self._drained_counters[name] = amount
+        return drained
+
+    def merge(self, drained: Dict) -> None:
+        """Fold in samples drained from another StageMetrics"""
+        with self._lock:
+            for stage, samples in drained.get('samples', {}).items():
+                self._samples[stage].extend(samples)
+            for name, amount in drained.get('counters', {}).items():
+                self._counters[name] += amount
+
+    def summary(self) -> Dict[str, Dict]:
+        """Count, total and percentile durations (in seconds) for every stage"""
+        with self._lock:
+            snapshot = {stage: sorted(samples) for stage, samples in self._samples.items()}
+        return {
+            stage: {
+                'count': len(samples),
+                'total': sum(samples),
+                'p50': percentile(samples, 0.50),
+                'p90': percentile(samples, 0.90),
+                'p99': percentile(samples, 0.99),
+                'max': samples[-1] if samples else 0.0,
+            }
+            for stage, samples in snapshot.items()
+        }
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def log_summary(self, target: Optional[logging.Logger] = None) -> None:
+        """Log one line per stage with its percentiles, then the counters"""
+        target = target or logger
+        summary = self.summary()
+        if not summary and not self._counters:
+            return
+
+        target.info("Stage timings (ms):")
+        for stage, stats in sorted(summary.items()):
+            target.info(
+                f"  {stage:<22} n={stats['count']:<7} total={stats['total'] * 1000:10.1f} "
+                f"p50={stats['p50'] * 1000:8.3f} p90={stats['p90'] * 1000:8.3f} "
+                f"p99={stats['p99'] * 1000:8.3f} max={stats['max'] * 1000:8.3f}"
+            )
+        for name, amount in sorted(self.counters.items()):
+            target.info(f"  {name:<22} {amount}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+
+
+def timed_stage(name: str):
+    """Method decorator that times each call on self.metrics under stage `name`"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
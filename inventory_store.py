@@ -0,0 +1,198 @@
+import csv
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Stored per device; the first nine match the data.csv column order
+DEVICE_FIELDS = (
+    'hostname',
+    'ip_address',
+    'location',
+    'access_vlan_id',
+    'access_vlan_name',
+    'voice_vlan_id',
+    'voice_vlan_name',
+    'model',
+    'mac_address',
+    'site',
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    hostname TEXT PRIMARY KEY COLLATE NOCASE,
+    ip_address TEXT NOT NULL DEFAULT '',
+    ip_int INTEGER,
+    location TEXT NOT NULL DEFAULT '',
+    access_vlan_id TEXT NOT NULL DEFAULT '',
+    access_vlan_name TEXT NOT NULL DEFAULT '',
+    voice_vlan_id TEXT NOT NULL DEFAULT '',
+    voice_vlan_name TEXT NOT NULL DEFAULT '',
+    model TEXT NOT NULL DEFAULT '',
+    mac_address TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    site TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS devices_ip ON devices (ip_int);
+CREATE INDEX IF NOT EXISTS devices_mac ON devices (mac_address);
+CREATE INDEX IF NOT EXISTS devices_site ON devices (site);
+"""
+
+_COLUMNS = DEVICE_FIELDS + ('ip_int', 'updated_at')
+_SELECT = f"SELECT {', '.join(DEVICE_FIELDS)} FROM devices"
+_INSERT = f"INSERT INTO devices ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' for _ in _COLUMNS)})"
+_UPSERT = _INSERT + " ON CONFLICT (hostname) DO UPDATE SET " + ', '.join(
+    f"{column} = excluded.{column}" for column in _COLUMNS if column != 'hostname'
+)
+
+
+def _ip_int(ip_address: str) -> Optional[int]:
+    import ipaddress
+
+    try:
+        return int(ipaddress.IPv4Address(ip_address))
+    except ipaddress.AddressValueError:
+        return None
+
+
+class DeviceInventory:
+    """SQLite-backed record of every device the generator has configured
+
+    Devices are keyed by hostname, with indexes on IP address, MAC address
+    and site, so single-device lookups and subnet queries do not scan the
+    whole inventory. IP addresses are also stored as integers so a subnet
+    is a range query. The connection is shared between threads behind a lock.
+
+    Rows without a 'site' value get the network config site whose subnet
+    contains their IP address, when a NetworkConfigLoader is given.
+    """
+
+    def __init__(self, path: str, network_config=None):
+        import sqlite3
+
+        self.path = path
+        self.network_config = network_config
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+
+    def _subnet_index(self):
+        return self.network_config.index if self.network_config is not None else None
+
+    @staticmethod
+    def _values(data: Dict, subnet_index=None) -> tuple:
+        values = {field: str(data.get(field) or '') for field in DEVICE_FIELDS}
+        if not values['site'] and subnet_index is not None:
+            try:
+                match = subnet_index.lookup(values['ip_address'])
+            except ValueError:
+                match = None
+            if match:
+                values['site'] = match[0]
+        return tuple(values.values()) + (_ip_int(values['ip_address']), time.time())
+
+    def _query(self, sql: str, parameters: tuple = ()) -> List[Dict]:
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    def append(self, data: Dict) -> None:
+        """Add a new device; raises ValueError if the hostname is already stored"""
+        import sqlite3
+
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(_INSERT, self._values(data, self._subnet_index()))
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Device {data.get('hostname')!r} is already in the inventory")
+
+    def upsert(self, data: Dict) -> None:
+        """Add a device or replace the stored record with the same hostname"""
+        with self._lock, self._connection:
+            self._connection.execute(_UPSERT, self._values(data, self._subnet_index()))
+
+    def upsert_many(self, rows: Iterable[Dict], batch_size: int = 1000) -> int:
+        """Upsert rows in transactions of batch_size and return how many were written"""
+        written = 0
+        batch = []
+        subnet_index = self._subnet_index()
+        for data in rows:
+            batch.append(self._values(data, subnet_index))
+            if len(batch) >= batch_size:
+                with self._lock, self._connection:
+                    self._connection.executemany(_UPSERT, batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            with self._lock, self._connection:
+                self._connection.executemany(_UPSERT, batch)
+            written += len(batch)
+        return written
+
+    def delete(self, hostname: str) -> bool:
+        with self._lock, self._connection:
+            cursor = self._connection.execute("DELETE FROM devices WHERE hostname = ?", (hostname,))
+        return cursor.rowcount > 0
+
+    def get(self, hostname: str) -> Optional[Dict]:
+        rows = self._query(f"{_SELECT} WHERE hostname = ?", (hostname,))
+        return rows[0] if rows else None
+
+    def find_by_mac(self, mac_address: str) -> Optional[Dict]:
+        rows = self._query(f"{_SELECT} WHERE mac_address = ?", (mac_address,))
+        return rows[0] if rows else None
+
+    def find_by_ip(self, ip_address: str) -> List[Dict]:
+        value = _ip_int(ip_address)
+        if value is None:
+            return []
+        return self._query(f"{_SELECT} WHERE ip_int = ?", (value,))
+
+    def in_subnet(self, cidr: str) -> List[Dict]:
+        """Devices whose address falls in a subnet such as 172.17.4.0/22, in address order"""
+        import ipaddress
+
+        network = ipaddress.IPv4Network(cidr, strict=False)
+        return self._query(
+            f"{_SELECT} WHERE ip_int BETWEEN ? AND ? ORDER BY ip_int",
+            (int(network.network_address), int(network.broadcast_address))
+        )
+
+    def by_site(self, site: str) -> List[Dict]:
+        return self._query(f"{_SELECT} WHERE site = ? ORDER BY hostname", (site,))
+
+    def __iter__(self) -> Iterator[Dict]:
+        """Every device in hostname order, fetched in batches rather than all at once"""
+        last_hostname = ''
+        while True:
+            rows = self._query(
+                f"{_SELECT} WHERE hostname > ? ORDER BY hostname LIMIT 1000", (last_hostname,)
+            )
+            yield from rows
+            if len(rows) < 1000:
+                return
+            last_hostname = rows[-1]['hostname']
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM devices").fetchone()[0]
+
+    def export_csv(self, filename: str) -> int:
+        """Write every device to a CSV with a header row and return the row count"""
+        count = 0
+        with open(filename, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(DEVICE_FIELDS)
+            for data in self:
+                writer.writerow([data[field] for field in DEVICE_FIELDS])
+                count += 1
+        return count
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,261 @@
+import base64
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from network_data import NetworkConfigLoader
+
+logger = logging.getLogger(__name__)
+
+# Marker accepted in the ip_address column in place of an address
+AUTO_ADDRESS = 'auto'
+
+# Management address lines in rendered configurations, used to seed the allocator
+CONFIG_ADDRESS_PATTERN = re.compile(r'ip address (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})')
+
+
+def _to_int(ip_address: str) -> int:
+    import ipaddress
+
+    return int(ipaddress.IPv4Address(ip_address))
+
+
+def _to_str(value: int) -> str:
+    import ipaddress
+
+    return str(ipaddress.IPv4Address(value))
+
+
+class AddressBitmap:
+    """One bit per address in a site's hosts_range, set when the address is used
+
+    Free addresses are searched for from a hint that only moves back when an
+    address is released, so handing out a run of addresses touches every
+    byte of the bitmap at most once.
+    """
+
+    def __init__(self, first: int, last: int, used: Optional[bytes] = None):
+        self.first = first
+        self.last = last
+        size = last - first + 1
+        self.bits = bytearray((size + 7) // 8)
+        if used is not None and len(used) == len(self.bits):
+            self.bits[:] = used
+        self.size = size
+        self._hint = 0
+
+    def __contains__(self, value: int) -> bool:
+        return self.first <= value <= self.last
+
+    def is_used(self, value: int) -> bool:
+        offset = value - self.first
+        return bool(self.bits[offset >> 3] & (1 << (offset & 7)))
+
+    def mark(self, value: int) -> None:
+        offset = value - self.first
+        self.bits[offset >> 3] |= 1 << (offset & 7)
+
+    def release(self, value: int) -> None:
+        offset = value - self.first
+        self.bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+        self._hint = min(self._hint, offset >> 3)
+
+    def allocate(self) -> Optional[int]:
+        """Mark and return the lowest free address, or None when the range is full"""
+        position = self._hint
+        while position < len(self.bits):
+            byte = self.bits[position]
+            if byte != 0xFF:
+                # Lowest clear bit of the byte
+                bit = (~byte & (byte + 1)).bit_length() - 1
+                offset = (position << 3) + bit
+                if offset >= self.size:
+                    break
+                self.bits[position] = byte | (1 << bit)
+                self._hint = position
+                return self.first + offset
+            position += 1
+        self._hint = position
+        return None
+
+    def free_count(self) -> int:
+        used = sum(bin(byte).count('1') for byte in self.bits)
+        return self.size - used
+
+
+class IPAllocator:
+    """Hands out free management addresses from each site's hosts_range
+
+    Used addresses are kept as a bitmap per site and persisted to path
+    together with the address given to each hostname, so a device keeps
+    its address across runs. The bitmaps are also seeded from inventory
+    rows and generated configurations so hand-picked addresses are never
+    handed out again. A site whose hosts_range changes starts from an
+    empty bitmap and is re-seeded.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str, network_config: NetworkConfigLoader):
+        self.path = path
+        self.network_config = network_config
+        self.assignments: Dict[str, str] = {}
+        self._bitmaps: Dict[str, AddressBitmap] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def _site_range(self, site: str):
+        data = self.network_config.load().get(site)
+        if not data or not data.get('hosts_range'):
+            return None
+        first, last = data['hosts_range']
+        return _to_int(first), _to_int(last)
+
+    def _bitmap(self, site: str) -> Optional[AddressBitmap]:
+        site_range = self._site_range(site)
+        if site_range is None:
+            return None
+        bitmap = self._bitmaps.get(site)
+        if bitmap is None or (bitmap.first, bitmap.last) != site_range:
+            bitmap = AddressBitmap(*site_range)
+            # The gateway usually sits outside hosts_range, but never hand it out
+            gateway = self.network_config.load()[site].get('gateway')
+            if gateway and _to_int(gateway) in bitmap:
+                bitmap.mark(_to_int(gateway))
+            self._bitmaps[site] = bitmap
+        return bitmap
+
+    def load(self) -> None:
+        """Read the persisted bitmaps and assignments, starting empty if missing or unreadable"""
+        try:
+            with open(self.path, 'r') as state_file:
+                content = json.load(state_file)
+            if content.get('version') != self.VERSION:
+                return
+            self.assignments = content.get('assignments', {})
+            for site, state in content.get('sites', {}).items():
+                self._bitmaps[site] = AddressBitmap(
+                    state['first'], state['last'], base64.b64decode(state['used'])
+                )
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, OSError) as e:
+            logger.warning(f"Ignoring unreadable IP allocation state {self.path}: {e}")
+            self.assignments = {}
+            self._bitmaps = {}
+
+    def save(self) -> None:
+        """Atomically write the bitmaps and assignments back to disk"""
+        with self._lock:
+            content = json.dumps({
+                'version': self.VERSION,
+                'assignments': self.assignments,
+                'sites': {
+                    site: {
+                        'first': bitmap.first,
+                        'last': bitmap.last,
+                        'used': base64.b64encode(bytes(bitmap.bits)).decode('ascii'),
+                    }
+                    for site, bitmap in self._bitmaps.items()
+                },
+            }, indent=1, sort_keys=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as state_file:
+            state_file.write(content)
+        os.replace(temp_path, self.path)
+
+    def mark_used(self, ip_address: str) -> bool:
+        """Record an address as taken; returns False if it is in no site's hosts_range"""
+        import ipaddress
+
+        try:
+            match = self.network_config.index.lookup(ip_address)
+        except ipaddress.AddressValueError:
+            return False
+        if not match:
+            return False
+
+        with self._lock:
+            bitmap = self._bitmap(match[0])
+            value = _to_int(ip_address)
+            if bitmap is None or value not in bitmap:
+                return False
+            bitmap.mark(value)
+            return True
+
+    def seed(self, addresses: Iterable[str]) -> int:
+        """Mark every given address as used and return how many fell in a hosts_range"""
+        return sum(1 for ip_address in addresses if ip_address and self.mark_used(ip_address))
+
+    def seed_from_configs(self, configs_path: str) -> int:
+        """Mark the management addresses found in generated configurations as used"""
+        seeded = 0
+        for name in os.listdir(configs_path):
+            try:
+                with open(os.path.join(configs_path, name), 'r') as config_file:
+                    seeded += self.seed(CONFIG_ADDRESS_PATTERN.findall(config_file.read()))
+            except (OSError, UnicodeDecodeError):
+                continue
+        return seeded
+
+    def seed_from_inventory(self, inventory) -> int:
+        """Mark the address of every device in a DeviceInventory as used"""
+        return self.seed(device['ip_address'] for device in inventory)
+
+    def allocate(self, site: str, hostname: Optional[str] = None) -> str:
+        """Return hostname's address at site, taking the next free one if it has none
+
+        Raises ValueError when the site is unknown, has no hosts_range or
+        has no free addresses left.
+        """
+        return self.allocate_block(site, [hostname])[0]
+
+    def allocate_block(self, site: str, hostnames: List[Optional[str]]) -> List[str]:
+        """Allocate one address per hostname at site in a single locked pass"""
+        addresses = []
+        with self._lock:
+            bitmap = self._bitmap(site)
+            if bitmap is None:
+                raise ValueError(f"Site {site!r} has no hosts_range in the network config")
+
+            for hostname in hostnames:
+                existing = self.assignments.get(hostname) if hostname else None
+                if existing and _to_int(existing) in bitmap:
+                    bitmap.mark(_to_int(existing))
+                    addresses.append(existing)
+                    continue
+
+                value = bitmap.allocate()
+                if value is None:
+                    raise ValueError(f"No free addresses left in the hosts_range of {site}")
+                ip_address = _to_str(value)
+                if hostname:
+                    self.assignments[hostname] = ip_address
+                addresses.append(ip_address)
+        return addresses
+
+    def release(self, hostname: str) -> Optional[str]:
+        """Return a hostname's address to the free pool"""
+        import ipaddress
+
+        with self._lock:
+            ip_address = self.assignments.pop(hostname, None)
+        if ip_address is None:
+            return None
+        try:
+            match = self.network_config.index.lookup(ip_address)
+        except ipaddress.AddressValueError:
+            return None
+        with self._lock:
+            bitmap = self._bitmaps.get(match[0]) if match else None
+            if bitmap is not None and _to_int(ip_address) in bitmap:
+                bitmap.release(_to_int(ip_address))
+        return ip_address
+
+    def free_count(self, site: str) -> int:
+        with self._lock:
+            bitmap = self._bitmap(site)
+            return bitmap.free_count() if bitmap else 0
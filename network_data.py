@@ -0,0 +1,207 @@
+import bisect
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SubnetIndex:
+    """Prebuilt lookup index over the subnets in network_config.json
+
+    Subnets are stored as integer ranges sorted by start address so a lookup
+    is a bisect plus a short walk up the enclosing subnets. CIDR blocks either
+    nest or are disjoint, so the walk always ends at the longest-prefix match.
+    """
+
+    def __init__(self, network_data: Dict):
+        import ipaddress
+
+        entries = []
+        for location, data in network_data.items():
+            network = ipaddress.IPv4Network(
+                f"{data['network_address']}/{data['subnet_mask']}",
+                strict=False
+            )
+            entries.append((
+                int(network.network_address),
+                int(network.broadcast_address),
+                location,
+                data
+            ))
+
+        # Widest subnet first for a shared start address, file order otherwise
+        entries.sort(key=lambda entry: (entry[0], -entry[1]))
+
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._locations: List[str] = []
+        self._data: List[Dict] = []
+        self._parents: List[int] = []
+        self.overlaps: List[Tuple[str, str]] = []
+
+        stack: List[int] = []
+        for start, end, location, data in entries:
+            if self._starts and self._starts[-1] == start and self._ends[-1] == end:
+                # Identical subnet listed twice: keep the first, as the old scan did
+                self.overlaps.append((self._locations[-1], location))
+                continue
+
+            while stack and self._ends[stack[-1]] < start:
+                stack.pop()
+            parent = stack[-1] if stack else -1
+            if parent >= 0:
+                self.overlaps.append((self._locations[parent], location))
+
+            self._starts.append(start)
+            self._ends.append(end)
+            self._locations.append(location)
+            self._data.append(data)
+            self._parents.append(parent)
+            stack.append(len(self._starts) - 1)
+
+        for outer, inner in self.overlaps:
+            logger.warning(f"Overlapping subnets in network config: {outer} contains {inner}")
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def lookup(self, ip_address: str) -> Optional[Tuple[str, Dict]]:
+        """Return (location name, location data) for the most specific subnet containing ip_address"""
+        import ipaddress
+
+        ip = int(ipaddress.IPv4Address(ip_address))
+
+        position = bisect.bisect_right(self._starts, ip) - 1
+        while position >= 0:
+            if ip <= self._ends[position]:
+                return self._locations[position], self._data[position]
+            position = self._parents[position]
+
+        return None
+
+
+_index_cache: Tuple[Optional[Dict], Optional[SubnetIndex]] = (None, None)
+
+
+def get_subnet_index(network_data: Dict) -> SubnetIndex:
+    """Return the SubnetIndex for network_data, rebuilding only when a different dict is passed"""
+    global _index_cache
+
+    cached_data, cached_index = _index_cache
+    if cached_index is None or cached_data is not network_data:
+        cached_index = SubnetIndex(network_data)
+        _index_cache = (network_data, cached_index)
+
+    return cached_index
+
+
+def build_site_context(location: str, data: Dict) -> Dict:
+    """Precompute the per-site values every device render at that site needs"""
+    import ipaddress
+
+    network = ipaddress.IPv4Network(
+        f"{data['network_address']}/{data['subnet_mask']}",
+        strict=False
+    )
+    if network.prefixlen < 22:
+        # The fixed wildcard only reaches one /22: the first of the site,
+        # where the device-IP form used before reached the device's own
+        logger.warning(
+            f"Site {location} is a /{network.prefixlen}; the templates' ip_acl "
+            f"only covers {network.network_address}/22"
+        )
+    return {
+        'location': location,
+        'gateway': data['gateway'],
+        'subnet': data['subnet_mask'],
+        'wildcard_mask': str(network.hostmask),
+        # First three octets of the site network. The ZTP templates append
+        # ".0" to it; all templates follow it with a fixed 0.0.3.255 wildcard,
+        # so for sites of /22 or longer it permits the same hosts as the
+        # device's own first three octets did
+        'ip_acl': str(network.network_address).rpartition('.')[0],
+    }
+
+
+class NetworkConfigLoader:
+    """Cached, change-aware loader for network_config.json
+
+    The file is only re-read when its mtime or size changes, and only
+    re-parsed when the content hash differs from the last parse. The subnet
+    index and the per-site render contexts are rebuilt together with it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stat_key: Optional[Tuple[int, int]] = None
+        self._content_hash: Optional[str] = None
+        # (data, index, contexts), swapped as one tuple so readers never mix versions
+        self._state: Tuple[Dict, Optional[SubnetIndex], Dict[str, Dict]] = ({}, None, {})
+
+    def refresh(self) -> bool:
+        """Reload the file if it changed on disk; return True when it was re-parsed"""
+        stat = os.stat(self.path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            if stat_key == self._stat_key:
+                return False
+
+            with open(self.path, 'rb') as json_file:
+                raw = json_file.read()
+            content_hash = hashlib.sha256(raw).hexdigest()
+
+            if content_hash == self._content_hash:
+                self._stat_key = stat_key
+                return False
+
+            # Nothing is recorded until the new content parses, so a broken
+            # file raises on every call instead of being skipped as seen
+            data = json.loads(raw)
+            contexts = {
+                location: build_site_context(location, location_data)
+                for location, location_data in data.items()
+            }
+            self._state = (data, get_subnet_index(data), contexts)
+            self._stat_key = stat_key
+            self._content_hash = content_hash
+            logger.info(f"Loaded {len(data)} locations from {self.path}")
+            return True
+
+    def load(self) -> Dict:
+        """Return the parsed network config, reloading it first if it changed"""
+        self.refresh()
+        return self._state[0]
+
+    @property
+    def content_hash(self) -> Optional[str]:
+        return self._content_hash
+
+    @property
+    def index(self) -> SubnetIndex:
+        self.refresh()
+        return self._state[1]
+
+    def site_context(self, location: str) -> Optional[Dict]:
+        """Return the precomputed render context for a named location"""
+        self.refresh()
+        return self._state[2].get(location)
+
+    def find_site_context(self, ip_address: str, refresh: bool = True) -> Optional[Dict]:
+        """Return the render context of the site whose subnet contains ip_address
+
+        Pass refresh=False when the caller has just called refresh() itself.
+        """
+        if refresh:
+            self.refresh()
+        _, index, contexts = self._state
+        match = index.lookup(ip_address)
+        if match:
+            return contexts[match[0]]
+
+        return None
@@ -0,0 +1,137 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Inventory fields that differ from switch to switch at the same site. Every
+# other template variable is the same for all devices sharing a model, site
+# and VLAN set, so it is bound once when a template is specialized.
+DEVICE_FIELDS = ('hostname', 'ip_address', 'location', 'mac_address')
+
+_PLACEHOLDER = '\x00{}\x00'
+_PLACEHOLDER_PATTERN = re.compile('\x00(' + '|'.join(DEVICE_FIELDS) + ')\x00')
+
+
+def split_values(values: Dict) -> Tuple[Dict, Dict]:
+    """Split template variables into (site-constant values, per-device values)"""
+    site_values = {name: value for name, value in values.items() if name not in DEVICE_FIELDS}
+    device_values = {name: value for name, value in values.items() if name in DEVICE_FIELDS}
+    return site_values, device_values
+
+
+def is_specializable(environment, template_name: str) -> bool:
+    """Whether a template only uses per-device fields as plain {{ field }} output
+
+    Those outputs can be filled in by string substitution after the rest of
+    the template has been rendered. A device field used in a condition,
+    loop, filter or assignment, or a template that includes or extends
+    another one, needs a full render for every device.
+    """
+    from jinja2 import meta, nodes
+
+    source, _, _ = environment.loader.get_source(environment, template_name)
+    tree = environment.parse(source)
+    if list(meta.find_referenced_templates(tree)):
+        return False
+
+    plain_outputs = sum(
+        1
+        for output in tree.find_all(nodes.Output)
+        for node in output.nodes
+        if isinstance(node, nodes.Name) and node.name in DEVICE_FIELDS
+    )
+    all_uses = sum(1 for node in tree.find_all(nodes.Name) if node.name in DEVICE_FIELDS)
+    return plain_outputs == all_uses
+
+
+class SiteTemplateCache:
+    """Templates pre-rendered with their site-constant variables bound
+
+    The first device for a (model, site values) combination costs one full
+    render with placeholders in place of the DEVICE_FIELDS; the result is
+    kept as a list of literal chunks and field names. Every later device at
+    that site is a join of those chunks with its own values. Entries are
+    dropped when the template is reloaded and the least recently used
+    entries are evicted beyond max_entries.
+    """
+
+    def __init__(self, max_entries: int = 4096, metrics=None):
+        self.max_entries = max_entries
+        # Optional StageMetrics; hits and specializations are counted there
+        self.metrics = metrics
+
+        self._entries: "OrderedDict[Tuple, Tuple[object, List[str]]]" = OrderedDict()
+        # template object -> whether it can be specialized
+        self._specializable: Dict[int, Tuple[object, bool]] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        if self.metrics:
+            self.metrics.count(name)
+
+    def _check(self, environment, template) -> bool:
+        with self._lock:
+            cached = self._specializable.get(id(template))
+        if cached and cached[0] is template:
+            return cached[1]
+
+        try:
+            specializable = is_specializable(environment, template.name)
+        except Exception as e:
+            # Precompiled templates may ship without their source
+            logger.debug(f"Cannot inspect {template.name}: {e}")
+            specializable = False
+        if not specializable:
+            logger.info(f"{template.name} uses device fields in logic; rendering it per device")
+
+        with self._lock:
+            self._specializable[id(template)] = (template, specializable)
+        return specializable
+
+    def _specialize(self, template, site_values: Dict) -> List[str]:
+        placeholders = {field: _PLACEHOLDER.format(field) for field in DEVICE_FIELDS}
+        skeleton = template.render(**site_values, **placeholders)
+        # Alternating literal text and field names: [text, field, text, ...]
+        return _PLACEHOLDER_PATTERN.split(skeleton)
+
+    def render(self, environment, template, site_values: Dict, device_values: Dict) -> str:
+        """Render template for one device, reusing the site's specialization when possible"""
+        return ''.join(self.generate(environment, template, site_values, device_values))
+
+    def generate(self, environment, template, site_values: Dict, device_values: Dict) -> Iterator[str]:
+        """Like render(), but yields the output in pieces for streaming to a file"""
+        if not self._check(environment, template):
+            return template.generate(**site_values, **device_values)
+
+        key = (template.name, tuple(sorted(site_values.items())))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is template:
+                self._entries.move_to_end(key)
+            else:
+                entry = None
+
+        if entry is None:
+            self._count('site_template_specializations')
+            entry = (template, self._specialize(template, site_values))
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        else:
+            self._count('site_template_hits')
+
+        return self._fill(entry[1], device_values)
+
+    @staticmethod
+    def _fill(parts: List[str], device_values: Dict) -> Iterator[str]:
+        for position, part in enumerate(parts):
+            yield str(device_values.get(part, '')) if position % 2 else part
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._specializable.clear()
@@ -1,14 +1,23 @@
 from jinja2 import Environment, FileSystemLoader
+import argparse
+import asyncio
 import csv
-import ipaddress
-import json
+from concurrent.futures import ThreadPoolExecutor
 from ftplib import FTP
 import os
 import logging
+import threading
+from functools import partial
+from network_data import NetworkConfigLoader
+from transfer import UploadScheduler
+from run_journal import RunJournal, row_key
 
 username = os.environ.get('username')
 password = os.environ.get('passwordAD')
 
+# Progress of the current run, read back by --resume
+JOURNAL_FILE = 'render-journal.jsonl'
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,18 +25,6 @@ logger = logging.getLogger(__name__)
 # Set up the Jinja2 environment with a file system loader
 env = Environment(loader=FileSystemLoader('/home/ansongdk/scripts/GUI/templates'))
 
-def find_location(ip_address, network_data):
-    # Convert the IP address string to an ipaddress.IPv4Address object
-    ip = ipaddress.IPv4Address(ip_address)
-
-    # Iterate through each location in the network_data dictionary
-    for location, data in network_data.items():
-        network_address = ipaddress.IPv4Network(f"{data['network_address']}/{data['subnet_mask']}", strict=False)
-        if ip in network_address:
-            return data
-
-    return None
-
 def download_csv_from_ftp(ftp_server_ip, ftp_username, ftp_password, remote_file, local_file):
     try:
         with FTP(ftp_server_ip, ftp_username, ftp_password) as ftp:
@@ -38,17 +35,53 @@ def download_csv_from_ftp(ftp_server_ip, ftp_username, ftp_password, remote_file
     except Exception as e:
         logger.error(f"Error downloading file from FTP server: {e}")
 
-def upload_to_ftp(ftp_server_ip, ftp_username, ftp_password, local_file, remote_file):
+# One logged-in FTP connection per upload thread, reused across files
+_ftp_local = threading.local()
+_ftp_connections = []
+_ftp_connections_lock = threading.Lock()
+
+def get_ftp_connection(ftp_server_ip, ftp_username, ftp_password):
+    ftp = getattr(_ftp_local, 'ftp', None)
+    if ftp is None:
+        ftp = FTP(ftp_server_ip, ftp_username, ftp_password)
+        _ftp_local.ftp = ftp
+        with _ftp_connections_lock:
+            _ftp_connections.append(ftp)
+    return ftp
+
+def drop_ftp_connection():
+    # Forget this thread's connection so the next attempt logs in again
+    ftp = getattr(_ftp_local, 'ftp', None)
+    _ftp_local.ftp = None
+    if ftp is not None:
+        with _ftp_connections_lock:
+            if ftp in _ftp_connections:
+                _ftp_connections.remove(ftp)
+        ftp.close()
+
+def close_ftp_connections():
+    with _ftp_connections_lock:
+        connections = list(_ftp_connections)
+        _ftp_connections.clear()
+    for ftp in connections:
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+
+def store_file_ftp(ftp_server_ip, ftp_username, ftp_password, local_file, remote_file):
+    # Single upload attempt; raises so the upload scheduler can retry it
+    ftp = get_ftp_connection(ftp_server_ip, ftp_username, ftp_password)
     try:
-        with FTP(ftp_server_ip, ftp_username, ftp_password) as ftp:
-            with open(local_file, 'rb') as file:
-                ftp.storbinary(f"STOR {remote_file}", file)
+        with open(local_file, 'rb') as file:
+            ftp.storbinary(f"STOR {remote_file}", file)
+    except Exception:
+        drop_ftp_connection()
+        raise
 
-        logger.info(f"Uploaded {local_file} to FTP server as {remote_file}")
-    except Exception as e:
-        logger.error(f"Error uploading file to FTP server: {e}")
+    logger.info(f"Uploaded {local_file} to FTP server as {remote_file}")
 
-def render_template(model, hostname, ip_address, access_vlan_id, access_vlan_name, voice_vlan_id, voice_vlan_name, location, gateway, subnet):
+def render_template(model, hostname, ip_address, access_vlan_id, access_vlan_name, voice_vlan_id, voice_vlan_name, location, gateway, subnet, ip_acl):
     template_file = model + '.j2'
     template = env.get_template(template_file)
 
@@ -63,58 +96,165 @@ def render_template(model, hostname, ip_address, access_vlan_id, access_vlan_nam
         voice_vlan_name=voice_vlan_name,
         location=location,
         gateway=gateway,
-        subnet=subnet
+        subnet=subnet,
+        ip_acl=ip_acl
     )
 
     return output
 
+def render_row(row, key, network_config, journal):
+    # Runs in the render thread pool: look up the site, render and save one device
+    hostname, ip_address, location, access_vlan_id, access_vlan_name, voice_vlan_id, voice_vlan_name, model = row
+    local_filename = f"{hostname}-confg.txt"
+    remote_filename = f"{hostname}-confg.txt"
+
+    # A resumed run only has to upload files it already wrote
+    if journal.is_done(hostname, key, 'written') and os.path.exists(local_filename):
+        return hostname, key, local_filename, remote_filename
+
+    # Find the precomputed site context for the given IP address
+    site_context = network_config.find_site_context(ip_address)
+    if not site_context:
+        logger.warning(f"No matching location found for IP address: {ip_address}")
+        journal.record(hostname, key, 'failed', f"no location for {ip_address}")
+        return None
+
+    # Render the template
+    rendered_output = render_template(
+        model=model,
+        hostname=hostname,
+        ip_address=ip_address,
+        access_vlan_id=access_vlan_id,
+        access_vlan_name=access_vlan_name,
+        voice_vlan_id=voice_vlan_id,
+        voice_vlan_name=voice_vlan_name,
+        location=location,
+        gateway=site_context["gateway"],
+        subnet=site_context["subnet"],
+        ip_acl=site_context["ip_acl"]
+    )
+    journal.record(hostname, key, 'rendered')
+
+    # Save the rendered output to a local file
+    with open(local_filename, 'w') as local_file:
+        local_file.write(rendered_output)
+    journal.record(hostname, key, 'written')
+
+    return hostname, key, local_filename, remote_filename
+
+async def read_stage(csv_file, row_queue, render_workers, journal):
+    # Stream rows from the CSV into the render stage, leaving out devices
+    # that a resumed run already uploaded
+    skipped = 0
+    with open(csv_file, 'r') as f:
+        for row in csv.reader(f):
+            if row:
+                key = row_key(row)
+                if journal.is_done(row[0], key, 'uploaded'):
+                    skipped += 1
+                    continue
+                await row_queue.put((row, key))
+    if skipped:
+        logger.info(f"Skipped {skipped} devices already uploaded in an earlier run")
+
+    for _ in range(render_workers):
+        await row_queue.put(None)
+
+async def render_stage(row_queue, upload_queue, network_config, render_executor, journal):
+    # Rendering is CPU work, so it runs in a thread pool to keep the event loop free
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await row_queue.get()
+        if item is None:
+            break
+        row, key = item
+        try:
+            result = await loop.run_in_executor(render_executor, render_row, row, key, network_config, journal)
+        except Exception as e:
+            logger.error(f"Error rendering row {row}: {e}")
+            journal.record(row[0], key, 'failed', str(e))
+            continue
+        if result:
+            await upload_queue.put(result)
+
+async def upload_stage(upload_queue, upload_scheduler, journal):
+    # Each upload worker keeps one transfer in flight on the scheduler's threads
+    while True:
+        item = await upload_queue.get()
+        if item is None:
+            break
+        hostname, key, local_filename, remote_filename = item
+        result = await asyncio.wrap_future(upload_scheduler.submit(local_filename, remote_filename))
+        if result.success:
+            journal.record(hostname, key, 'uploaded')
+        else:
+            journal.record(hostname, key, 'failed', result.error)
+
+async def run_pipeline(ftp_server_ip, ftp_username, ftp_password, render_workers=2, upload_workers=4, queue_size=100,
+                       journal_file=JOURNAL_FILE, resume=False):
+    # Download 'data.csv' from FTP server to local directory
+    await asyncio.to_thread(
+        download_csv_from_ftp, ftp_server_ip, ftp_username, ftp_password, 'data.csv', 'data.csv'
+    )
+
+    # Network data is parsed once and only reloaded if the file changes
+    network_config = NetworkConfigLoader('network_config.json')
+
+    # Bounded queues between stages so a slow stage applies back-pressure
+    row_queue = asyncio.Queue(maxsize=queue_size)
+    upload_queue = asyncio.Queue(maxsize=queue_size)
+
+    # Each device's completed stages; --resume skips what it shows as done
+    journal = RunJournal(journal_file, resume=resume)
+
+    render_executor = ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix="render")
+    upload_scheduler = UploadScheduler(
+        partial(store_file_ftp, ftp_server_ip, ftp_username, ftp_password),
+        concurrency=upload_workers
+    )
+
+    try:
+        uploaders = [
+            asyncio.create_task(upload_stage(upload_queue, upload_scheduler, journal))
+            for _ in range(upload_workers)
+        ]
+        await asyncio.gather(
+            read_stage('data.csv', row_queue, render_workers, journal),
+            *(
+                render_stage(row_queue, upload_queue, network_config, render_executor, journal)
+                for _ in range(render_workers)
+            )
+        )
+        for _ in range(upload_workers):
+            await upload_queue.put(None)
+        await asyncio.gather(*uploaders)
+    finally:
+        render_executor.shutdown(wait=True)
+        upload_scheduler.close()
+        journal.close()
+        await asyncio.to_thread(close_ftp_connections)
+
+    # Report the final status of every upload
+    for line in upload_scheduler.report():
+        logger.info(line)
+
 def main():
+    parser = argparse.ArgumentParser(description="Render and upload a configuration for every row of data.csv")
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="Skip work the journal shows as done; retry devices that failed or never ran"
+    )
+    parser.add_argument('--journal', default=JOURNAL_FILE, help=f"Run journal (default: {JOURNAL_FILE})")
+    args = parser.parse_args()
+
     # FTP server details
     ftp_server_ip = "10.36.50.60"
     ftp_username = username
     ftp_password = password
 
-    # Download 'data.csv' from FTP server to local directory
-    download_csv_from_ftp(ftp_server_ip, ftp_username, ftp_password, 'data.csv', 'data.csv')
-
-    # Load data from the downloaded CSV file
-    with open('data.csv', 'r') as f:
-        csv_data = csv.reader(f)
-        for row in csv_data:
-            hostname, ip_address, location, access_vlan_id, access_vlan_name, voice_vlan_id, voice_vlan_name, model = row
-
-            # Load network data from the JSON file
-            with open('network_config.json', 'r') as json_file:
-                network_data = json.load(json_file)
-
-            # Find the location data for the given IP address
-            location_data = find_location(ip_address, network_data)
-
-            if location_data:
-                # Render the template
-                rendered_output = render_template(
-                    model=model,
-                    hostname=hostname,
-                    ip_address=ip_address,
-                    access_vlan_id=access_vlan_id,
-                    access_vlan_name=access_vlan_name,
-                    voice_vlan_id=voice_vlan_id,
-                    voice_vlan_name=voice_vlan_name,
-                    location=location,
-                    gateway=location_data["gateway"],
-                    subnet=location_data["subnet_mask"]
-                )
-
-                # Save the rendered output to a local file
-                local_filename = f"{hostname}-confg.txt"
-                with open(local_filename, 'w') as local_file:
-                    local_file.write(rendered_output)
-
-                # Upload the local file to the FTP server
-                remote_filename = f"{hostname}-confg.txt"
-                upload_to_ftp(ftp_server_ip, ftp_username, ftp_password, local_filename, remote_filename)
-            else:
-                logger.warning(f"No matching location found for IP address: {ip_address}")
+    asyncio.run(run_pipeline(
+        ftp_server_ip, ftp_username, ftp_password, journal_file=args.journal, resume=args.resume
+    ))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Per-device stages in the order a run completes them
+STAGES = ('rendered', 'written', 'uploaded')
+
+
+def row_key(values: Sequence[str]) -> str:
+    """Short hash of an inventory row, so resumed runs redo rows that were edited"""
+    return hashlib.sha256('\x1f'.join(values).encode()).hexdigest()[:16]
+
+
+class RunJournal:
+    """Append-only record of how far each device got in a run
+
+    Each line is one JSON object naming a device, the key of the row it was
+    rendered from and a stage it completed (or "failed" with the error).
+    Lines are written as they happen but only fsync'd every sync_every
+    records or sync_interval seconds, so a crash loses at most the last
+    batch. A torn final line is ignored on load.
+
+    With resume=True the existing journal is read and appended to; otherwise
+    it is started afresh.
+    """
+
+    def __init__(self, path: str, resume: bool = False, sync_every: int = 100, sync_interval: float = 1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        # device -> (row key, index into STAGES of the furthest stage completed)
+        self._completed: Dict[str, Tuple[str, int]] = {}
+        if resume:
+            self._load()
+
+        self._lock = threading.Lock()
+        self._file = open(path, 'a' if resume else 'w')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get('stage') in STAGES:
+                        self._advance(entry['device'], entry['key'], STAGES.index(entry['stage']))
+        except FileNotFoundError:
+            return
+        logger.info(f"Loaded run journal {self.path}: {len(self._completed)} devices with progress")
+
+    def _advance(self, device: str, key: str, stage: int) -> None:
+        previous = self._completed.get(device)
+        # Progress recorded against an older version of the row does not count
+        if previous is None or previous[0] != key or previous[1] < stage:
+            self._completed[device] = (key, stage)
+
+    def is_done(self, device: str, key: str, stage: str) -> bool:
+        """Whether device already completed stage for this version of its row"""
+        completed = self._completed.get(device)
+        return completed is not None and completed[0] == key and completed[1] >= STAGES.index(stage)
+
+    def record(self, device: str, key: str, stage: str, error: Optional[str] = None) -> None:
+        """Append a completed stage, or "failed" with the error, for one device"""
+        entry = {'device': device, 'key': key, 'stage': stage, 'ts': round(time.time(), 3)}
+        if error:
+            entry['error'] = error
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            if stage in STAGES:
+                self._advance(device, key, STAGES.index(stage))
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    def _sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self) -> None:
+        with self._lock:
+            self._sync()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
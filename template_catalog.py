@@ -0,0 +1,260 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IOS_CONFIG = 'ios-config'
+ZTP_PYTHON = 'ztp-python'
+
+TEMPLATE_SUFFIX = '.j2'
+
+
+class TemplateInfo(NamedTuple):
+    model: str
+    content_hash: str
+    # Undeclared variables the template reads, from jinja2.meta
+    variables: FrozenSet[str]
+    output_type: str
+    # Templates it includes, imports or extends directly, relative to the templates directory
+    includes: FrozenSet[str] = frozenset()
+
+
+def output_type_of(source: str) -> str:
+    """ZTP_PYTHON for templates that render a ZTP Python script, else IOS_CONFIG"""
+    for line in source.splitlines():
+        line = line.strip()
+        if line:
+            return ZTP_PYTHON if line.startswith(('import ', 'from ', '#!')) else IOS_CONFIG
+    return IOS_CONFIG
+
+
+def inspect_template(model: str, content: bytes) -> TemplateInfo:
+    """Parse a template file's contents and describe it"""
+    from jinja2 import Environment, meta
+
+    source = content.decode('utf-8')
+    parsed = Environment().parse(source)
+    return TemplateInfo(
+        model,
+        hashlib.sha256(content).hexdigest(),
+        frozenset(meta.find_undeclared_variables(parsed)),
+        output_type_of(source),
+        # Names built at render time come back as None and cannot be followed
+        frozenset(name for name in meta.find_referenced_templates(parsed) if name)
+    )
+
+
+class TemplateCatalog:
+    """Metadata for every model template in a directory
+
+    Each template is parsed once for its content hash, the variables it
+    needs and the kind of file it renders. Entries are kept, keyed by the
+    file's mtime and size, in memory and in a JSON file at cache_path, so a
+    new process only parses templates that changed since the last one; a
+    changed file is re-read the next time it is looked up.
+
+    provided is the set of variables the renderer passes to every template.
+    A template that needs anything else would render blanks, so its model
+    is reported as incompatible.
+
+    Files a model's template includes, imports or extends are tracked the
+    same way, in memory only, so closure_hash() changes when any of them do.
+    """
+
+    VERSION = 2
+
+    def __init__(self, templates_path: str, cache_path: Optional[str] = None, provided: Iterable[str] = ()):
+        self.templates_path = templates_path
+        self.cache_path = cache_path
+        self.provided: FrozenSet[str] = frozenset(provided)
+        # model -> ((mtime_ns, size), info)
+        self._entries: Dict[str, Tuple[Tuple[int, int], TemplateInfo]] = {}
+        # included file name -> ((mtime_ns, size), info)
+        self._included: Dict[str, Tuple[Tuple[int, int], TemplateInfo]] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path) as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if cached.get('version') != self.VERSION:
+            return
+        for model, entry in cached.get('templates', {}).items():
+            self._entries[model] = (
+                tuple(entry['stat']),
+                TemplateInfo(
+                    model, entry['content_hash'], frozenset(entry['variables']),
+                    entry['output_type'], frozenset(entry['includes'])
+                )
+            )
+
+    def _save(self) -> None:
+        import tempfile
+
+        if not self.cache_path:
+            return
+        with self._lock:
+            templates = {
+                model: {
+                    'stat': list(stat_key),
+                    'content_hash': info.content_hash,
+                    'variables': sorted(info.variables),
+                    'output_type': info.output_type,
+                    'includes': sorted(info.includes),
+                }
+                for model, (stat_key, info) in self._entries.items()
+            }
+        content = json.dumps({'version': self.VERSION, 'templates': templates}, indent=2)
+        # One save at a time, each through its own temporary file, so
+        # concurrent savers never share or truncate each other's output
+        with self._save_lock:
+            try:
+                directory = os.path.dirname(os.path.abspath(self.cache_path))
+                os.makedirs(directory, exist_ok=True)
+                cache_file = tempfile.NamedTemporaryFile(
+                    'w', dir=directory, prefix=f"{os.path.basename(self.cache_path)}.",
+                    suffix='.tmp', delete=False
+                )
+                try:
+                    with cache_file:
+                        cache_file.write(content)
+                    os.replace(cache_file.name, self.cache_path)
+                except OSError:
+                    os.remove(cache_file.name)
+                    raise
+            except OSError as e:
+                logger.warning(f"Could not save template catalog to {self.cache_path}: {e}")
+
+    def _lookup(self, model: str) -> Tuple[Optional[TemplateInfo], bool]:
+        """(info, whether the entry changed), or (None, ...) if there is no template"""
+        path = os.path.join(self.templates_path, f"{model}{TEMPLATE_SUFFIX}")
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                removed = self._entries.pop(model, None) is not None
+            return None, removed
+
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._entries.get(model)
+        if cached and cached[0] == stat_key:
+            return cached[1], False
+
+        with open(path, 'rb') as template_file:
+            info = inspect_template(model, template_file.read())
+        if cached is None or cached[1] != info:
+            logger.info(f"Catalogued template {model}: {info.output_type}, {len(info.variables)} variables")
+        with self._lock:
+            self._entries[model] = (stat_key, info)
+        return info, True
+
+    def get(self, model: str) -> Optional[TemplateInfo]:
+        """Metadata for a model's template, re-read if the file changed; None if there is none"""
+        info, changed = self._lookup(model)
+        if changed:
+            self._save()
+        return info
+
+    def _included_info(self, name: str) -> Optional[TemplateInfo]:
+        """Metadata for a file pulled in by a template, re-read if it changed; None if it is missing"""
+        path = os.path.join(self.templates_path, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._included.get(name)
+        if cached and cached[0] == stat_key:
+            return cached[1]
+
+        with open(path, 'rb') as template_file:
+            info = inspect_template(name, template_file.read())
+        with self._lock:
+            self._included[name] = (stat_key, info)
+        return info
+
+    def closure_hash(self, model: str) -> Optional[str]:
+        """Hash of a model's template and everything it pulls in; None if there is no template
+
+        For a template that pulls nothing in this is its content hash.
+        """
+        info = self.get(model)
+        if info is None:
+            return None
+        if not info.includes:
+            return info.content_hash
+
+        hashes = {f"{model}{TEMPLATE_SUFFIX}": info.content_hash}
+        pending = list(info.includes)
+        while pending:
+            name = pending.pop()
+            if name in hashes:
+                continue
+            included = self._included_info(name)
+            hashes[name] = included.content_hash if included else 'missing'
+            if included:
+                pending.extend(included.includes)
+        return hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()
+
+    def refresh(self) -> Dict[str, TemplateInfo]:
+        """Rescan the directory, picking up added, changed and removed templates"""
+        models = {
+            name[:-len(TEMPLATE_SUFFIX)]
+            for name in os.listdir(self.templates_path)
+            if name.endswith(TEMPLATE_SUFFIX)
+        }
+        with self._lock:
+            models |= set(self._entries)
+
+        changed = False
+        templates = {}
+        for model in sorted(models):
+            info, model_changed = self._lookup(model)
+            changed = changed or model_changed
+            if info is not None:
+                templates[model] = info
+        if changed:
+            self._save()
+        return templates
+
+    def missing_variables(self, info: TemplateInfo) -> FrozenSet[str]:
+        """Variables the template reads that the renderer does not provide"""
+        return info.variables - self.provided
+
+    def problem(self, model: str) -> Optional[str]:
+        """Why devices of this model cannot be rendered, or None if they can"""
+        info = self.get(model)
+        if info is None:
+            return f"no template for model {model!r}"
+        missing = self.missing_variables(info)
+        if missing:
+            return f"template {model}{TEMPLATE_SUFFIX} needs variables that are never provided: {', '.join(sorted(missing))}"
+        return None
+
+    def models(self, compatible_only: bool = True) -> List[str]:
+        """Models with a template, leaving out incompatible ones unless asked not to"""
+        return [
+            model for model, info in self.refresh().items()
+            if not compatible_only or not self.missing_variables(info)
+        ]
+
+    def incompatible(self) -> Dict[str, FrozenSet[str]]:
+        """Each incompatible model and the variables its template is missing"""
+        return {
+            model: self.missing_variables(info)
+            for model, info in self.refresh().items()
+            if self.missing_variables(info)
+        }
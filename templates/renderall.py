@@ -1,48 +1,48 @@
 import json
-import ipaddress
 import csv
+import os
+import sys
+
+# network_data.py lives one level up, next to config_gen.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from network_data import SubnetIndex
 
 # Load the network configuration from the JSON file
 with open('network_config.json', 'r') as json_file:
     network_data = json.load(json_file)
 
+# Build the subnet lookup index once for the whole run
+subnet_index = SubnetIndex(network_data)
+
 def find_subnet(ip_address):
-    # Convert the IP address string to an ipaddress.IPv4Address object
-    ip = ipaddress.IPv4Address(ip_address)
-
-    # Iterate through each location in the network_data dictionary
-    for location, data in network_data.items():
-        network_address = ipaddress.IPv4Network(f"{data['network_address']}/{data['subnet_mask']}", strict=False)
-        if ip in network_address:
-            # The IP address falls within the range of this location
-            return {
-                "location": location,
-                "subnet_mask": data["subnet_mask"],
-                "gateway": data["gateway"]
-            }
+    # Look the IP address up in the prebuilt subnet index
+    match = subnet_index.lookup(ip_address)
+    if match:
+        location, data = match
+        # The IP address falls within the range of this location
+        return {
+            "location": location,
+            "subnet_mask": data["subnet_mask"],
+            "gateway": data["gateway"]
+        }
 
     # If no match is found
     return None
 
+def matched_rows(csv_file_path):
+    # Stream the CSV one row at a time, yielding only rows in a known subnet
+    with open(csv_file_path, 'r') as csv_file:
+        reader = csv.DictReader(csv_file)
+        for row in reader:
+            ip_address = row.get('ip_address')
+            if ip_address:
+                result = find_subnet(ip_address)
+                if result:
+                    yield ip_address, result
+
 # Read IP addresses from the CSV file
 csv_file_path = 'your_csv_file.csv'  # Replace with the actual path to your CSV file
-result_data = []
-
-with open(csv_file_path, 'r') as csv_file:
-    reader = csv.DictReader(csv_file)
-    for row in reader:
-        ip_address = row.get('ip_address')
-        if ip_address:
-            result = find_subnet(ip_address)
-            if result:
-                result_data.append({
-                    "ip_address": ip_address,
-                    "location": result["location"],
-                    "subnet_mask": result["subnet_mask"],
-                    "gateway": result["gateway"]
-                })
-
-
-# Display the results
-for result in result_data:
-    print(f"IP Address: {result['ip_address']}, Location: {result['location']}, Subnet Mask: {result['subnet_mask']}, Gateway: {result['gateway']}")
+
+# Display each result as soon as it is found, so memory stays flat for large files
+for ip_address, result in matched_rows(csv_file_path):
+    print(f"IP Address: {ip_address}, Location: {result['location']}, Subnet Mask: {result['subnet_mask']}, Gateway: {result['gateway']}")
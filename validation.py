@@ -0,0 +1,134 @@
+import logging
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from ip_allocation import AUTO_ADDRESS
+from network_data import SubnetIndex
+from template_catalog import ZTP_PYTHON, TemplateCatalog, TemplateInfo
+
+logger = logging.getLogger(__name__)
+
+MAC_PATTERN = re.compile(r'^([0-9A-Fa-f]{2}){6}$')
+VLAN_FIELDS = ('access_vlan_id', 'voice_vlan_id')
+MIN_VLAN_ID = 1
+MAX_VLAN_ID = 4094
+
+
+def is_valid_mac(mac_address: str) -> bool:
+    """Whether mac_address is 12 hex digits with no separators"""
+    return bool(mac_address) and MAC_PATTERN.match(mac_address) is not None
+
+
+class ValidationIssue(NamedTuple):
+    row: int
+    hostname: str
+    field: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"row {self.row} ({self.hostname or 'no hostname'}): {self.field}: {self.message}"
+
+
+class InventoryValidator:
+    """Checks a whole inventory in one pass before anything is rendered
+
+    Every row is checked for MAC and IP syntax, VLAN id range, a known
+    subnet for its IP and a template for its model that needs no variables
+    beyond the ones the renderer provides; with allow_incomplete, templates
+    that need more are only logged as a warning. Rows asking for an 'auto'
+    address need a site (the 'site' column, or the location) that has a
+    hosts_range to allocate from. Hostnames, IPs and MACs are tracked in
+    sets as rows stream past, so duplicates anywhere in the file are
+    reported against the row that repeats them.
+    """
+
+    def __init__(
+        self,
+        subnet_index: SubnetIndex,
+        catalog: TemplateCatalog,
+        allocatable_sites: Iterable[str] = (),
+        allow_incomplete: bool = False
+    ):
+        self.subnet_index = subnet_index
+        self.catalog = catalog
+        self.allocatable_sites: Set[str] = set(allocatable_sites)
+        self.allow_incomplete = allow_incomplete
+        # model -> (template info, problem), looked up once per validator
+        self._models: Dict[str, Tuple[Optional[TemplateInfo], Optional[str]]] = {}
+
+    def _model(self, model: str) -> Tuple[Optional[TemplateInfo], Optional[str]]:
+        if model not in self._models:
+            template, problem = self.catalog.get(model), self.catalog.problem(model)
+            if template is not None and problem and self.allow_incomplete:
+                logger.warning(f"Allowing incomplete template: {problem}")
+                problem = None
+            self._models[model] = (template, problem)
+        return self._models[model]
+
+    def validate_row(self, row: int, data: Dict, seen: Dict[str, Dict[str, int]]) -> List[ValidationIssue]:
+        """Issues for one row; seen maps each unique field to the values already used"""
+        import ipaddress
+
+        issues = []
+        hostname = data.get('hostname', '')
+
+        def issue(field: str, message: str) -> None:
+            issues.append(ValidationIssue(row, hostname, field, message))
+
+        def check_unique(field: str, value: str) -> None:
+            first_row = seen[field].setdefault(value, row)
+            if first_row != row:
+                issue(field, f"duplicate of row {first_row}")
+
+        if not hostname:
+            issue('hostname', "missing")
+        else:
+            check_unique('hostname', hostname.lower())
+
+        ip_address = data.get('ip_address', '')
+        if ip_address.lower() == AUTO_ADDRESS:
+            site = data.get('site') or data.get('location', '')
+            if site not in self.allocatable_sites:
+                issue('ip_address', f"cannot allocate: {site!r} is not a site with a hosts_range")
+        else:
+            try:
+                if self.subnet_index.lookup(ip_address) is None:
+                    issue('ip_address', f"{ip_address} is not in any known subnet")
+                check_unique('ip_address', ip_address)
+            except ipaddress.AddressValueError:
+                issue('ip_address', f"invalid IPv4 address {ip_address!r}")
+
+        mac_address = data.get('mac_address', '')
+        if mac_address:
+            if not is_valid_mac(mac_address):
+                issue('mac_address', f"invalid MAC {mac_address!r} (should be 12 characters 0-9 & a-f)")
+            else:
+                check_unique('mac_address', mac_address.lower())
+
+        model = data.get('model', '')
+        template, problem = self._model(model)
+        if problem:
+            issue('model', problem)
+        if template is not None and template.output_type == ZTP_PYTHON and not mac_address:
+            issue('mac_address', f"required for ZTP model {model}")
+
+        for field in VLAN_FIELDS:
+            value = data.get(field, '')
+            if not value.isdigit() or not MIN_VLAN_ID <= int(value) <= MAX_VLAN_ID:
+                issue(field, f"{value!r} is not a VLAN id between {MIN_VLAN_ID} and {MAX_VLAN_ID}")
+
+        return issues
+
+    def validate(self, rows: Iterable[Dict], max_issues: Optional[int] = None) -> List[ValidationIssue]:
+        """Check every row and return the issues found, in file order
+
+        Stops early once max_issues have been collected.
+        """
+        seen: Dict[str, Dict[str, int]] = {'hostname': {}, 'ip_address': {}, 'mac_address': {}}
+        issues: List[ValidationIssue] = []
+        for row, data in enumerate(rows, start=1):
+            issues.extend(self.validate_row(row, data, seen))
+            if max_issues and len(issues) >= max_issues:
+                del issues[max_issues:]
+                break
+        return issues
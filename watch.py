@@ -0,0 +1,154 @@
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from network_data import SubnetIndex
+
+logger = logging.getLogger(__name__)
+
+
+def template_includes(environment, template_name: str) -> Set[str]:
+    """Templates that template_name includes, imports or extends, directly"""
+    from jinja2 import meta
+
+    try:
+        source, _, _ = environment.loader.get_source(environment, template_name)
+        return {name for name in meta.find_referenced_templates(environment.parse(source)) if name}
+    except Exception as e:
+        logger.warning(f"Cannot read dependencies of {template_name}: {e}")
+        return set()
+
+
+class DependencyGraph:
+    """Which devices each template file and each network config site feeds
+
+    A device depends on its model's template, every template that one
+    pulls in, and the site whose subnet contains its IP address.
+    """
+
+    def __init__(self, devices: Iterable[Dict], subnet_index: SubnetIndex, environment=None):
+        self.devices: Dict[str, Dict] = {}
+        self.device_sites: Dict[str, Optional[str]] = {}
+        self.by_template: Dict[str, Set[str]] = defaultdict(set)
+        self.by_site: Dict[str, Set[str]] = defaultdict(set)
+
+        includes: Dict[str, Set[str]] = {}
+        for data in devices:
+            hostname = data['hostname']
+            self.devices[hostname] = data
+
+            template_name = f"{data['model']}.j2"
+            for name in self._closure(environment, template_name, includes):
+                self.by_template[name].add(hostname)
+
+            site = self.site_of(subnet_index, data['ip_address'])
+            self.device_sites[hostname] = site
+            if site:
+                self.by_site[site].add(hostname)
+
+    @staticmethod
+    def site_of(subnet_index: SubnetIndex, ip_address: str) -> Optional[str]:
+        try:
+            match = subnet_index.lookup(ip_address)
+        except ValueError:
+            return None
+        return match[0] if match else None
+
+    @staticmethod
+    def _closure(environment, template_name: str, includes: Dict[str, Set[str]]) -> Set[str]:
+        seen = set()
+        pending = [template_name]
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            if environment is not None:
+                if name not in includes:
+                    includes[name] = template_includes(environment, name)
+                pending.extend(includes[name])
+        return seen
+
+    def affected_by_templates(self, template_names: Iterable[str]) -> Set[str]:
+        affected = set()
+        for name in template_names:
+            affected |= self.by_template.get(name, set())
+        return affected
+
+    def affected_by_network_config(
+        self,
+        old_data: Dict,
+        new_data: Dict,
+        new_index: SubnetIndex
+    ) -> Set[str]:
+        """Devices at sites whose entry changed, plus devices that now fall in another site"""
+        changed_sites = {
+            site for site in set(old_data) | set(new_data)
+            if old_data.get(site) != new_data.get(site)
+        }
+        affected = set()
+        for site in changed_sites:
+            affected |= self.by_site.get(site, set())
+        if changed_sites:
+            for hostname, data in self.devices.items():
+                if self.site_of(new_index, data['ip_address']) != self.device_sites[hostname]:
+                    affected.add(hostname)
+        return affected
+
+
+class FileWatcher:
+    """Polls files for changes to their mtime or size
+
+    Polling keeps the watcher dependency-free and behaves the same on
+    network shares, where change notifications are unreliable.
+    """
+
+    def __init__(self, directories: Iterable[str] = (), files: Iterable[str] = (), suffix: str = ''):
+        self.directories = list(directories)
+        self.files = list(files)
+        self.suffix = suffix
+        self._stats = self._scan()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        stats = {}
+        paths = list(self.files)
+        for directory in self.directories:
+            for root, subdirectories, names in os.walk(directory):
+                subdirectories[:] = [name for name in subdirectories if name != '__pycache__']
+                paths.extend(os.path.join(root, name) for name in names if name.endswith(self.suffix))
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                stats[path] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                continue
+        return stats
+
+    def poll(self) -> Set[str]:
+        """Paths added, removed or modified since the previous poll"""
+        stats = self._scan()
+        changed = {
+            path for path in set(stats) | set(self._stats)
+            if stats.get(path) != self._stats.get(path)
+        }
+        self._stats = stats
+        return changed
+
+    def wait_for_changes(self, interval: float = 1.0, debounce: float = 1.0) -> Set[str]:
+        """Block until something changes, then until nothing has changed for debounce seconds"""
+        changed: Set[str] = set()
+        while not changed:
+            time.sleep(interval)
+            changed = self.poll()
+
+        quiet_since = time.monotonic()
+        while time.monotonic() - quiet_since < debounce:
+            time.sleep(min(interval, debounce))
+            more = self.poll()
+            if more:
+                changed |= more
+                quiet_since = time.monotonic()
+        return changed
+
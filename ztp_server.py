@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CachedConfig(NamedTuple):
+    version: str
+    etag: str
+    body: bytes
+
+
+class ConfigCache:
+    """Rendered configurations held in memory, keyed by device
+
+    Each entry remembers the version (input hash) it was rendered from. A
+    lookup with a different version renders again, so edits to the
+    inventory, network config or templates are picked up on the next request.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, CachedConfig] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.renders = 0
+
+    def get_or_render(self, key: str, version: str, render: Callable[[], str]) -> CachedConfig:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                self.hits += 1
+                return entry
+
+        body = render().encode()
+        entry = CachedConfig(version, f'"{hashlib.sha256(body).hexdigest()[:32]}"', body)
+        with self._lock:
+            self._entries[key] = entry
+            self.renders += 1
+        return entry
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+# resolve(file name) -> (cache key, version, render callable), or None if unknown
+Resolver = Callable[[str], Optional[Tuple[str, str, Callable[[], str]]]]
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header value matches etag (weak comparison)"""
+    if if_none_match.strip() == '*':
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(','))
+    return any((tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
+
+
+def _handler(resolve: Resolver, cache: ConfigCache):
+    class ZTPRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            logger.debug(f"{self.client_address[0]} {format % args}")
+
+        def _respond(self, send_body: bool) -> None:
+            name = self.path.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+            try:
+                resolved = resolve(name)
+                entry = cache.get_or_render(*resolved) if resolved else None
+            except Exception as e:
+                logger.error(f"Could not render {name} for {self.client_address[0]}: {e}")
+                self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR)
+                return
+            if entry is None:
+                self.send_error(HTTPStatus.NOT_FOUND)
+                return
+
+            if etag_matches(self.headers.get('If-None-Match', ''), entry.etag):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header('ETag', entry.etag)
+                self.end_headers()
+                return
+
+            content_type = 'text/x-python' if name.endswith('.py') else 'text/plain'
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', f"{content_type}; charset=utf-8")
+            self.send_header('Content-Length', str(len(entry.body)))
+            self.send_header('ETag', entry.etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            if send_body:
+                self.wfile.write(entry.body)
+            logger.info(f"Served {name} to {self.client_address[0]}")
+
+        def do_GET(self):
+            self._respond(send_body=True)
+
+        def do_HEAD(self):
+            self._respond(send_body=False)
+
+    return ZTPRequestHandler
+
+
+class ZTPServer:
+    """HTTP server that hands ZTP scripts and configurations to booting switches
+
+    Files are rendered on their first request and then served from memory;
+    each request runs on its own thread. Clients that send the ETag of the
+    current file in If-None-Match get a 304 without a body.
+    """
+
+    def __init__(self, resolve: Resolver, host: str = '0.0.0.0', port: int = 8080):
+        self.cache = ConfigCache()
+        self.httpd = ThreadingHTTPServer((host, port), _handler(resolve, self.cache))
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.httpd.server_address[:2]
+
+    def serve_forever(self) -> None:
+        logger.info(f"Serving ZTP files on http://{self.address[0]}:{self.address[1]}/")
+        self.httpd.serve_forever()
+
+    def start(self) -> None:
+        """Serve from a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+        self.httpd.server_close()